@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Benchmarks and load testing tools for pyaib
+
+Each module can be run directly with python -m pyaib.bench.<module>
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import time
+
+
+def timeit(func, *args, **kwargs):
+    """ Run func with args and return (seconds, result) """
+    start = time.time()
+    result = func(*args, **kwargs)
+    return (time.time() - start, result)
+
+
+def chunked(data, size=4096):
+    """ Split bytes up the way recv(size) would hand them to us """
+    return [data[i:i + size] for i in range(0, len(data), size)]
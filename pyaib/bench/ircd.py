@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+A tiny local irc server for driving a real bot under load
+
+Speaks just enough RFC 1459 for pyaib: registration, PING, JOIN/PART,
+PRIVMSG/NOTICE fan-out, NAMES and QUIT, with ircd style flood limits.
+Virtual users live inside the server so load can be generated without
+opening a socket per user.
+
+Usage: python -m pyaib.bench.ircd [--port 6667]
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import time
+
+import gevent
+from gevent.server import StreamServer
+
+ISUPPORT = ('CASEMAPPING=rfc1459 CHANTYPES=# PREFIX=(ov)@+ NICKLEN=30 '
+            'MODES=4 CHANMODES=b,k,l,imnpst TARGMAX=PRIVMSG:4,NOTICE:4,JOIN:')
+
+
+def parse(line):
+    """ Split a client line into (command, params) """
+    if line.startswith(':'):
+        line = line.partition(' ')[2]
+    line, sep, trailing = line.partition(' :')
+    params = line.split()
+    if not params:
+        return (None, [])
+    if sep:
+        params.append(trailing)
+    return (params[0].upper(), params[1:])
+
+
+class VirtualUser(object):
+    """ A user that only exists inside the server """
+    virtual = True
+
+    def __init__(self, nick):
+        self.nick = nick
+        self.user = nick.lower() if nick else None
+        self.host = 'virtual.bench'
+        self.channels = set()
+
+    @property
+    def mask(self):
+        return '%s!%s@%s' % (self.nick, self.user, self.host)
+
+    def send(self, line):
+        pass
+
+    def numeric(self, code, *params):
+        pass
+
+
+class Connection(VirtualUser):
+    """ A real client connected over a socket """
+    virtual = False
+
+    def __init__(self, server, sock, address):
+        VirtualUser.__init__(self, None)
+        self.server = server
+        self.sock = sock
+        self.host = address[0]
+        self.registered = False
+        self.closed = False
+        #Flood bucket
+        self.tokens = server.flood_burst
+        self.updated = time.time()
+
+    def send(self, line):
+        if self.closed:
+            return
+        try:
+            self.sock.sendall(line.encode('utf-8') + b'\r\n')
+        except Exception:
+            self.closed = True
+
+    def numeric(self, code, *params):
+        params = list(params)
+        if params:
+            params[-1] = ':' + params[-1]
+        self.send(' '.join([':' + self.server.name, code,
+                            self.nick or '*'] + params))
+
+    def flooded(self):
+        """ Spend a token, True if the client is over the limit """
+        rate = self.server.flood_rate
+        if not rate:
+            return False
+        now = time.time()
+        self.tokens = min(self.server.flood_burst,
+                          self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= 1
+        return self.tokens < 0
+
+
+class FakeIRCd(object):
+    """ The server, StreamServer handler plus channel state """
+    #Commands allowed before registration
+    UNREGISTERED = frozenset(['CAP', 'PASS', 'USER', 'NICK', 'PING', 'PONG',
+                              'QUIT'])
+
+    def __init__(self, name='irc.bench', flood_burst=10, flood_rate=1.0):
+        self.name = name
+        #ircd style flood limits, rate of 0 turns them off
+        self.flood_burst = flood_burst
+        self.flood_rate = flood_rate
+        self.users = {}  # lower nick -> VirtualUser/Connection
+        self.channels = {}  # lower channel -> {lower nick: (prefix, user)}
+        #Called with (user, target, text, timestamp) for real clients
+        self.listeners = []
+        #Counters
+        self.lines_in = 0
+        self.lines_out = 0
+        self.kills = 0
+
+    def listen(self, host='127.0.0.1', port=0):
+        self.server = StreamServer((host, port), self.handle)
+        self.server.start()
+        return self.server.server_port
+
+    def stop(self):
+        self.server.stop()
+
+    #Connection handling
+    def handle(self, sock, address):
+        conn = Connection(self, sock, address)
+        rfile = sock.makefile('rb')
+        try:
+            for raw in rfile:
+                line = raw.rstrip(b'\r\n').decode('utf-8', 'ignore')
+                if not line:
+                    continue
+                self.lines_in += 1
+                if conn.registered and conn.flooded():
+                    self.kills += 1
+                    self.quit(conn, 'Excess Flood')
+                    break
+                command, params = parse(line)
+                handler = getattr(self, 'on_%s' % command, None)
+                if not conn.registered and command not in self.UNREGISTERED:
+                    conn.numeric('451', 'You have not registered')
+                elif handler is not None:
+                    handler(conn, params)
+                elif conn.registered:
+                    conn.numeric('421', command, 'Unknown command')
+                if conn.closed:
+                    break
+        finally:
+            if not conn.closed:
+                self.quit(conn, 'Connection closed')
+            rfile.close()
+            sock.close()
+
+    def quit(self, user, message):
+        self.fanout(user, ':%s QUIT :%s' % (user.mask, message),
+                    others=True)
+        for channel in list(user.channels):
+            self.channels[channel].pop(user.nick.lower(), None)
+        user.channels.clear()
+        if user.nick and self.users.get(user.nick.lower()) is user:
+            del self.users[user.nick.lower()]
+        if not user.virtual:
+            user.send('ERROR :Closing Link: %s (%s)' % (user.host, message))
+            user.closed = True
+
+    def fanout(self, user, line, others=False):
+        """ Send a line to everybody sharing a channel with user """
+        seen = set()
+        for channel in user.channels:
+            for key, (_, member) in self.channels[channel].items():
+                if key not in seen and not (others and member is user):
+                    seen.add(key)
+                    self.lines_out += 1
+                    member.send(line)
+
+    def _welcome(self, conn):
+        if conn.registered or not conn.nick or not conn.user:
+            return
+        conn.registered = True
+        conn.numeric('001', 'Welcome to the bench network %s' % conn.mask)
+        conn.numeric('002', 'Your host is %s' % self.name)
+        conn.numeric('003', 'This server was created just now')
+        conn.send(':%s 004 %s %s bench o o' % (self.name, conn.nick,
+                                               self.name))
+        conn.send(':%s 005 %s %s :are supported by this server'
+                  % (self.name, conn.nick, ISUPPORT))
+        conn.numeric('422', 'MOTD File is missing')
+
+    #Commands
+    def on_CAP(self, conn, params):
+        if params and params[0].upper() == 'LS':
+            conn.send(':%s CAP * LS :' % self.name)
+        elif params and params[0].upper() == 'REQ':
+            conn.send(':%s CAP * NAK :%s' % (self.name, params[-1]))
+
+    def on_PASS(self, conn, params):
+        pass
+
+    def on_USER(self, conn, params):
+        if params:
+            conn.user = params[0]
+            self._welcome(conn)
+
+    def on_NICK(self, conn, params):
+        if not params:
+            return conn.numeric('431', 'No nickname given')
+        nick = params[0]
+        if nick.lower() in self.users and \
+                self.users[nick.lower()] is not conn:
+            return conn.numeric('433', nick, 'Nickname is already in use')
+        if conn.nick:
+            self.users.pop(conn.nick.lower(), None)
+            line = ':%s NICK :%s' % (conn.mask, nick)
+            if conn.channels:
+                self.fanout(conn, line)
+            else:
+                conn.send(line)
+            for channel in conn.channels:
+                members = self.channels[channel]
+                members[nick.lower()] = members.pop(conn.nick.lower())
+        conn.nick = nick
+        self.users[nick.lower()] = conn
+        self._welcome(conn)
+
+    def on_PING(self, conn, params):
+        conn.send(':%s PONG %s :%s' % (self.name, self.name,
+                                       params[-1] if params else ''))
+
+    def on_PONG(self, conn, params):
+        pass
+
+    def on_QUIT(self, conn, params):
+        self.quit(conn, params[-1] if params else 'Quit')
+
+    def on_JOIN(self, user, params):
+        if not params:
+            return
+        for name in params[0].split(','):
+            if not name.startswith('#'):
+                user.numeric('403', name, 'No such channel')
+                continue
+            self.join(user, name)
+
+    def join(self, user, name):
+        key = name.lower()
+        members = self.channels.setdefault(key, {})
+        if user.nick.lower() in members:
+            return
+        #First one in gets ops
+        members[user.nick.lower()] = ('@' if not members else '', user)
+        user.channels.add(key)
+        self.fanout_channel(key, ':%s JOIN %s' % (user.mask, name))
+        #Virtual users have nobody to read the NAMES reply
+        if not user.virtual:
+            self.on_NAMES(user, [name])
+
+    def on_PART(self, user, params):
+        if not params:
+            return
+        message = params[1] if len(params) > 1 else ''
+        for name in params[0].split(','):
+            key = name.lower()
+            if key not in user.channels:
+                user.numeric('442', name, "You're not on that channel")
+                continue
+            self.fanout_channel(key, ':%s PART %s :%s'
+                                % (user.mask, name, message))
+            del self.channels[key][user.nick.lower()]
+            user.channels.discard(key)
+
+    def on_NAMES(self, conn, params):
+        for name in params[0].split(',') if params else []:
+            members = self.channels.get(name.lower(), {})
+            names = []
+            for prefix, member in members.values():
+                names.append(prefix + member.nick)
+                if len(names) >= 50:
+                    conn.numeric('353', '=', name, ' '.join(names))
+                    names = []
+            if names:
+                conn.numeric('353', '=', name, ' '.join(names))
+            conn.numeric('366', name, 'End of /NAMES list.')
+
+    def on_WHO(self, conn, params):
+        conn.numeric('315', params[0] if params else '*', 'End of /WHO list.')
+
+    def on_MODE(self, conn, params):
+        pass
+
+    def on_PRIVMSG(self, user, params, command='PRIVMSG'):
+        if len(params) < 2:
+            return user.numeric('412', 'No text to send')
+        targets, text = params[0], params[-1]
+        now = time.time()
+        for target in targets.split(','):
+            self.message(user, command, target, text)
+            if not user.virtual:
+                for listener in self.listeners:
+                    listener(user, target, text, now)
+
+    def on_NOTICE(self, user, params):
+        self.on_PRIVMSG(user, params, command='NOTICE')
+
+    def message(self, user, command, target, text):
+        line = ':%s %s %s :%s' % (user.mask, command, target, text)
+        if target.startswith('#'):
+            members = self.channels.get(target.lower())
+            if members is None:
+                return user.numeric('403', target, 'No such channel')
+            for key, (_, member) in members.items():
+                if member is not user:
+                    self.lines_out += 1
+                    member.send(line)
+        else:
+            member = self.users.get(target.lower())
+            if member is None:
+                return user.numeric('401', target, 'No such nick/channel')
+            self.lines_out += 1
+            member.send(line)
+
+    def fanout_channel(self, key, line):
+        for _, member in self.channels[key].values():
+            self.lines_out += 1
+            member.send(line)
+
+    #Virtual users
+    def add_virtual(self, nick, channels=()):
+        user = VirtualUser(nick)
+        self.users[nick.lower()] = user
+        for channel in channels:
+            self.join(user, channel)
+        return user
+
+    def say(self, user, target, text, command='PRIVMSG'):
+        self.message(user, command, target, text)
+
+    def members(self, channel):
+        return [member.nick for _, member
+                in self.channels.get(channel.lower(), {}).values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6667)
+    parser.add_argument('--flood-burst', type=float, default=10)
+    parser.add_argument('--flood-rate', type=float, default=1.0,
+                        help='lines/s allowed after the burst, 0 is no limit')
+    args = parser.parse_args()
+    ircd = FakeIRCd(flood_burst=args.flood_burst, flood_rate=args.flood_rate)
+    port = ircd.listen(args.host, args.port)
+    print('Listening on %s:%d' % (args.host, port))
+    while True:
+        gevent.sleep(60)
+        print('lines in: %d out: %d kills: %d'
+              % (ircd.lines_in, ircd.lines_out, ircd.kills))
+
+
+if __name__ == '__main__':
+    main()
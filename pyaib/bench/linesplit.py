@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Benchmark LineSocket line splitting against recorded bursts
+
+Usage: python -m pyaib.bench.linesplit [recording ...]
+
+A recording is either a file of raw bytes as read off the socket (CRLF
+delimited) or a .gz recording made by pyaib.bench.recording.
+Without any recordings a NAMES reply and a netsplit burst are synthesized.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import sys
+
+from ..linesocket import LineSocketBuffers, LINEENDING
+from . import timeit, chunked
+from .recording import read_recording
+
+
+def names_burst(count=5000):
+    """ A big NAMES reply, lots of short lines """
+    lines = [':irc.example.net 353 botbot = #big :@op +voice user%d' % i
+             for i in range(count)]
+    lines.append(':irc.example.net 366 botbot #big :End of /NAMES list.')
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+def netsplit_burst(count=5000):
+    """ Everybody on the other side of the split quits at once """
+    lines = [':user%d!~u%d@host%d.example.net QUIT :a.example.net '
+             'b.example.net' % (i, i, i) for i in range(count)]
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+def legacy_split(buffers):
+    """ The old per line rescan and memmove loop """
+    lines = []
+    while LINEENDING in buffers.readbuffer:
+        size = buffers.readbuffer.find(LINEENDING)
+        lines.append(buffers.readbuffer_mv()[0:size].tobytes())
+        del buffers.readbuffer[0:size + 2]
+    return lines
+
+
+def feed(chunks, split):
+    """ Push recv sized chunks through a splitter, return the line count """
+    buffers = LineSocketBuffers()
+    count = 0
+    for chunk in chunks:
+        buffers.readbuffer.extend(chunk)
+        count += len(split(buffers))
+    return count
+
+
+def run(name, data, rounds=20):
+    chunks = chunked(data)
+    results = {}
+    for label, split in (('legacy', legacy_split),
+                         ('splitlines', LineSocketBuffers.splitlines)):
+        best = None
+        for _ in range(rounds):
+            seconds, count = timeit(feed, chunks, split)
+            best = seconds if best is None else min(best, seconds)
+        results[label] = (best, count)
+        print('%-12s %-10s %8d lines %10.0f lines/s'
+              % (name, label, count, count / best if best else 0))
+    if results['legacy'][1] != results['splitlines'][1]:
+        print('%s: line counts differ!' % name)
+    return results
+
+
+def main(argv):
+    if argv:
+        bursts = []
+        for path in argv:
+            if path.endswith('.gz'):
+                lines = [raw for _, raw in read_recording(path)]
+                bursts.append((path, ('\r\n'.join(lines) + '\r\n')
+                               .encode('utf-8')))
+            else:
+                with open(path, 'rb') as recording:
+                    bursts.append((path, recording.read()))
+    else:
+        bursts = [('names', names_burst()), ('netsplit', netsplit_burst())]
+    for name, data in bursts:
+        run(name, data)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+End to end load test of a real bot against the local fake ircd
+
+Usage: python -m pyaib.bench.load <bot config> --trigger '!test' [options]
+
+The bot runs IrcBot.run() over a loopback socket to pyaib.bench.ircd.
+N virtual users spread over M channels send the trigger at a target rate
+and the latency from each PRIVMSG to the bot's reply in that channel is
+reported as percentiles.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import collections
+import random
+import time
+
+from ..ircbot import IrcBot
+from .ircd import FakeIRCd
+
+import gevent
+
+
+def percentile(ordered, pct):
+    """ Nearest rank percentile of an already sorted list """
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class LoadGenerator(object):
+    """ Drive virtual users at a bot and time its replies """
+    def __init__(self, ircd, botnick, users=100, channels=10, rate=10.0,
+                 trigger='!test', replies=1):
+        self.ircd = ircd
+        self.botnick = botnick
+        self.trigger = trigger
+        self.rate = rate
+        #Lines the trigger answers with, each request waits for all of them
+        self.replies = replies
+        self.channels = ['#load%d' % i for i in range(channels)]
+        self.users = []
+        for i in range(users):
+            #Every user sits in a couple of channels
+            chans = random.sample(self.channels, min(2, channels))
+            self.users.append(ircd.add_virtual('user%d' % i, chans))
+        #channel -> deque of [sent time, replies left]
+        self.outstanding = collections.defaultdict(collections.deque)
+        self.latencies = []
+        self.sent = 0
+        ircd.listeners.append(self.on_message)
+
+    def on_message(self, user, target, text, timestamp):
+        """ Match bot replies to the oldest request in that channel """
+        if user.nick != self.botnick:
+            return
+        waiting = self.outstanding.get(target.lower())
+        if not waiting:
+            return
+        request = waiting[0]
+        request[1] -= 1
+        if request[1] <= 0:
+            waiting.popleft()
+            self.latencies.append(timestamp - request[0])
+
+    def joined(self):
+        """ True once the bot is in all of our channels """
+        return all(self.botnick in self.ircd.members(channel)
+                   for channel in self.channels)
+
+    def run(self, duration):
+        interval = 1.0 / self.rate
+        start = time.time()
+        next_send = start
+        while time.time() - start < duration:
+            user = random.choice(self.users)
+            channel = random.choice(list(user.channels))
+            self.outstanding[channel].append([time.time(), self.replies])
+            self.ircd.say(user, channel, self.trigger)
+            self.sent += 1
+            next_send += interval
+            gevent.sleep(max(0, next_send - time.time()))  # Yield
+
+    def report(self):
+        ordered = sorted(self.latencies)
+        missing = sum(len(waiting) for waiting in self.outstanding.values())
+        print('requests: %d replied: %d missing: %d'
+              % (self.sent, len(ordered), missing))
+        for pct in (50, 90, 95, 99, 100):
+            print('p%-3d %8.1fms' % (pct, percentile(ordered, pct) * 1000))
+        print('server lines in: %d out: %d flood kills: %d'
+              % (self.ircd.lines_in, self.ircd.lines_out, self.ircd.kills))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('config', help='bot config file')
+    parser.add_argument('--trigger', default='!test',
+                        help='text the virtual users send')
+    parser.add_argument('--replies', type=int, default=1,
+                        help='lines the bot answers each trigger with')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='triggers per second across all users')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--drain', type=float, default=10.0,
+                        help='seconds to wait for late replies')
+    parser.add_argument('--server-burst', type=float, default=10)
+    parser.add_argument('--server-rate', type=float, default=0,
+                        help='server flood limit in lines/s, 0 is no limit')
+    args = parser.parse_args()
+
+    ircd = FakeIRCd(flood_burst=args.server_burst,
+                    flood_rate=args.server_rate)
+    port = ircd.listen()
+
+    bot = IrcBot(args.config)
+    bot.config['irc.servers'] = ['127.0.0.1:%d' % port]
+    load = LoadGenerator(ircd, bot.config.irc.nick, users=args.users,
+                         channels=args.channels, rate=args.rate,
+                         trigger=args.trigger, replies=args.replies)
+    bot.config['channels.autojoin'] = list(load.channels)
+    bot.config['channels.db'] = False
+    gevent.spawn(bot.run)
+
+    print('Waiting for the bot to join %d channels...' % len(load.channels))
+    while not load.joined():
+        gevent.sleep(0.1)
+    print('Sending %.1f triggers/s for %.0fs...' % (args.rate, args.duration))
+    load.run(args.duration)
+    gevent.sleep(args.drain)
+    load.report()
+
+
+if __name__ == '__main__':
+    main()
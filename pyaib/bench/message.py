@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Micro-benchmark irc.Message parsing, attribute access and copying
+
+Usage: python -m pyaib.bench.message [recording]
+
+Without a recording a mix of common server traffic is used.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import sys
+
+from .. import irc
+from . import timeit
+from .recording import read_recording
+
+SAMPLE = [
+    ':nick!~user@host.example.net PRIVMSG #channel :!karma somebody',
+    ':nick!~user@host.example.net PRIVMSG botbot :hello there',
+    ':other!~them@other.example.net NOTICE #channel :a notice',
+    ':nick!~user@host.example.net JOIN :#channel',
+    ':nick!~user@host.example.net QUIT :Ping timeout: 240 seconds',
+    ':irc.example.net 353 botbot = #channel :@op +voice user1 user2',
+    'PING :irc.example.net',
+]
+
+
+def context():
+    irc_c = irc.Context()
+    irc_c.botnick = 'botbot'
+    irc_c.server = 'irc.example.net'
+    return irc_c
+
+
+def parse(irc_c, lines):
+    return [irc.Message(irc_c, raw) for raw in lines]
+
+
+def access(msgs):
+    for msg in msgs:
+        msg.nick, msg.channel, msg.message
+
+
+def copy(irc_c, msgs):
+    for msg in msgs:
+        msg.copy(irc_c).channel
+
+
+def reparse(irc_c, msgs):
+    """ What copy used to cost, a fresh parse of the raw line """
+    for msg in msgs:
+        type(msg)(irc_c, msg.raw).channel
+
+
+def main(argv):
+    if argv:
+        lines = [raw for _, raw in read_recording(argv[0])]
+    else:
+        lines = SAMPLE * 20000
+    irc_c = context()
+    seconds, msgs = timeit(parse, irc_c, lines)
+    results = [('parse', seconds)]
+    results.append(('access', timeit(access, msgs)[0]))
+    #Copies start from parsed messages like they do in Triggers._handler
+    results.append(('copy', timeit(copy, irc_c, msgs)[0]))
+    results.append(('reparse', timeit(reparse, irc_c, msgs)[0]))
+    for name, seconds in results:
+        print('%-8s %8.3fs %8.2fus/msg'
+              % (name, seconds, seconds * 1e6 / len(lines)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Record raw inbound irc lines for later replay
+
+Load as a component to record everything IRC_RAW_MSG sees:
+
+components.load:
+    - bench.recording
+
+recording:
+    path: /tmp/botbot.rec.gz
+
+Recordings are gzipped, one json [seconds since start, raw line] per line.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import gzip
+import json
+import time
+
+from ..components import component_class, observes
+
+
+def read_recording(path):
+    """ Iterate over (offset, raw) pairs in a recording """
+    with gzip.open(path, 'rb') as recording:
+        lines = iter(recording)
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration:
+                return
+            except EOFError:
+                #The bot was killed before it closed the recording
+                print("Recording %s was cut off" % path)
+                return
+            offset, raw = json.loads(line.decode('utf-8'))
+            yield (offset, raw)
+
+
+class RecordingWriter(object):
+    """ Append raw lines to a recording """
+    def __init__(self, path, flush_every=100):
+        self.file = gzip.open(path, 'wb')
+        self.start = time.time()
+        self.flush_every = flush_every
+        self.count = 0
+
+    def write(self, raw, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.file.write(json.dumps([round(timestamp - self.start, 6), raw])
+                        .encode('utf-8') + b'\n')
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+@component_class('recording')
+class Recording(object):
+    """ Record IRC_RAW_MSG lines to config.path """
+    def __init__(self, irc_c, config):
+        path = config.path or 'pyaib-%d.rec.gz' % time.time()
+        self.writer = RecordingWriter(path, config.flush_every or 100)
+        print("Recording raw lines to %s" % path)
+
+    #Inline keeps the lines in the order they came in
+    @observes('IRC_RAW_MSG', dispatch='inline')
+    def record(self, irc_c, raw):
+        self.writer.write(raw)
+
+    @observes('IRC_SHUTDOWN', dispatch='inline')
+    def close(self, irc_c):
+        self.writer.close()
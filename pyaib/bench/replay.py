@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Replay a recording through a full IrcBot without a network
+
+Usage: python -m pyaib.bench.replay <bot config> <recording> [--timing]
+
+Lines are fed to the bot through a fake LineSocket, either as fast as the
+bot takes them or with the recorded timing. Reports lines/s along with
+where the time went: parsing, event dispatch and handlers.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import time
+
+from ..ircbot import IrcBot
+from .. import irc
+from ..linesocket import LineSocket, encode_line, LINEENDING
+from .recording import read_recording
+
+import gevent
+from gevent.event import Event
+
+
+class FakeLineSocket(object):
+    """ Stand in for LineSocket that reads from a recording """
+    def __init__(self, client, recording, timing=False, speed=1.0, batch=32):
+        self.client = client
+        self.recording = recording
+        self.timing, self.speed, self.batch = (timing, speed, batch)
+        self.position = 0
+        self.start = None
+        self._mark = None
+        self._closed = Event()
+        #Counters
+        self.busy = 0.0  # Time the client spent on the lines we gave it
+        self.bytes_out = 0
+        self.lines_out = 0
+
+    def run(self):
+        self._closed.wait()  # Yield
+
+    def close(self):
+        self._closed.set()
+
+    def readlines(self, block=True):
+        now = time.time()
+        if self._mark is not None:
+            self.busy += now - self._mark
+        if self.start is None:
+            self.start = now
+        if self.position >= len(self.recording):
+            self.finish()
+
+        batch = []
+        if self.timing:
+            offset = self.recording[self.position][0] / self.speed
+            gevent.sleep(max(0, self.start + offset - now))  # Yield
+            now = time.time() - self.start
+            while (self.position < len(self.recording)
+                    and self.recording[self.position][0] / self.speed <= now):
+                batch.append(self.recording[self.position][1])
+                self.position += 1
+        else:
+            gevent.sleep(0)  # Let handlers run like a real recv would
+            end = self.position + self.batch
+            batch = [raw for _, raw in self.recording[self.position:end]]
+            self.position += len(batch)
+        self._mark = time.time()
+        return batch
+
+    def readline(self):
+        return self.readlines()[0]
+
+    def finish(self, timeout=60):
+        """ Wait for handlers to drain then end the connection """
+        group = self.client.irc_c.bot_greenlets
+        pool = self.client.irc_c.bot_pool
+        deadline = time.time() + timeout
+        #Only the long running timers loop should be left
+        while ((len(group) + len(group.urgent) > 1 or len(pool))
+               and time.time() < deadline):
+            gevent.sleep(0.01)
+        self.end = time.time()
+        self.client.reconnect = False
+        raise LineSocket.SocketError('EOF')
+
+    def writeline(self, line):
+        self.writelines([line])
+
+    def writelines(self, lines):
+        for line in lines:
+            self.bytes_out += len(encode_line(line)) + len(LINEENDING)
+        self.lines_out += len(lines)
+
+
+class ReplayClient(irc.Client):
+    """ irc.Client that connects to a recording """
+    def __init__(self, irc_c, recording, **kwargs):
+        irc.Client.__init__(self, irc_c)
+        self.fake = FakeLineSocket(self, recording, **kwargs)
+
+    def _try_connect(self):
+        self.socket = self.fake
+        return self.fake
+
+
+class HandlerTimer(object):
+    """ Time everything spawned into the bot greenlets """
+    def __init__(self, group):
+        self.seconds = 0.0
+        self.count = 0
+        #spawn goes through submit too
+        self._submit = group.submit
+        group.submit = self.submit
+
+    def submit(self, priority, func, *args, **kwargs):
+        return self._submit(priority, self.timed, func, *args, **kwargs)
+
+    def timed(self, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.seconds += time.time() - start
+            self.count += 1
+
+
+def parse_time(irc_c, recording):
+    """ Seconds spent just parsing every line of the recording """
+    start = time.time()
+    for _, raw in recording:
+        irc.Message(irc_c, raw)
+    return time.time() - start
+
+
+def replay(config, recording, timing=False, speed=1.0, batch=32,
+           flood=False):
+    bot = IrcBot(config)
+    if not flood:
+        #We want to count outbound bytes not wait on the bucket
+        bot.config['irc.flood.rate'] = 0
+    parse = parse_time(bot.irc_c, recording)
+    handlers = HandlerTimer(bot.irc_c.bot_greenlets)
+    client = ReplayClient(bot.irc_c, recording, timing=timing, speed=speed,
+                          batch=batch)
+    gevent.spawn(client.run).join()
+    fake = client.fake
+    return {'lines': len(recording),
+            'wall': fake.end - fake.start,
+            'parse': parse,
+            'dispatch': max(fake.busy - parse, 0.0),
+            'handlers': handlers.seconds,
+            'handler_calls': handlers.count,
+            'bytes_out': fake.bytes_out,
+            'lines_out': fake.lines_out}
+
+
+def report(results):
+    lines = results['lines'] or 1
+    print('lines:      %d in %.3fs (%.0f lines/s)'
+          % (results['lines'], results['wall'],
+             results['lines'] / results['wall'] if results['wall'] else 0))
+    for key in ('parse', 'dispatch', 'handlers'):
+        print('%-11s %.3fs (%.1fus/line)'
+              % (key + ':', results[key], results[key] * 1e6 / lines))
+    print('handler calls: %d' % results['handler_calls'])
+    print('outbound:   %d lines %d bytes'
+          % (results['lines_out'], results['bytes_out']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('config', help='bot config file')
+    parser.add_argument('recording', help='recording made by bench.recording')
+    parser.add_argument('--timing', action='store_true',
+                        help='replay with the recorded timing')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed up recorded timing by this factor')
+    parser.add_argument('--batch', type=int, default=32,
+                        help='lines handed over per read at max speed')
+    parser.add_argument('--flood', action='store_true',
+                        help='keep the configured flood control')
+    args = parser.parse_args()
+    recording = list(read_recording(args.recording))
+    report(replay(args.config, recording, timing=args.timing,
+                  speed=args.speed, batch=args.batch, flood=args.flood))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Benchmark reply wrapping and RAW clean up against the textwrap path
+
+Usage: python -m pyaib.bench.wrap [rounds]
+
+Long multilingual replies are wrapped the old way (textwrap, re.sub and
+expandtabs, counting characters) and the new way (irc.wrap counting
+encoded bytes). Lines that would go over 512 bytes on the wire are
+counted as overflows, the server truncates those.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import re
+import sys
+import textwrap
+
+from .. import irc
+from . import timeit
+
+SENDER = 'botbot!~botbot@bot.example.net'
+TARGET = '#channel'
+
+SAMPLES = {
+    'ascii': 'The quick brown fox jumps over the lazy dog. ',
+    'latin': 'Ça roule? Größe, mañana, smørrebrød, één keer. ',
+    'cjk': '日本語のテキストはとても長くなることがあります。 ',
+    'cyrillic': 'Съешь же ещё этих мягких французских булок. ',
+    'emoji': 'ship it 🚀🚀 looks good 👍 tests pass ✅ ',
+    'colors': '\x0304,01red\x0f \x02bold\x02 \x0312blue\x03 plain ',
+}
+
+
+def replies(text, count=200, repeat=40):
+    return [text * repeat] * count
+
+
+def legacy(msgs):
+    """ What Context.PRIVMSG used to do """
+    template = 'PRIVMSG %s :%%s' % TARGET
+    prefix = len(SENDER) + 2 + len(template % '')
+    out = []
+    for msg in msgs:
+        for line in textwrap.wrap(msg, irc.MAX_LENGTH - prefix):
+            line = re.sub(r'[\r\n]', '', template % line).expandtabs(4)
+            out.append(line.rstrip())
+    return out
+
+
+def current(msgs):
+    """ The byte counting path """
+    template = 'PRIVMSG %s :%%s' % TARGET
+    out = []
+    for msg in msgs:
+        prefix = irc.prefix_length(SENDER, 'PRIVMSG', TARGET)
+        for line in irc.wrap(msg.translate(irc.WRAP_WHITESPACE),
+                             irc.MAX_LENGTH - prefix):
+            out.append((template % line).translate(irc.SANITIZE).rstrip())
+    return out
+
+
+def overflows(lines):
+    """ Lines longer than the server will relay """
+    limit = irc.MAX_LENGTH - len(SENDER) - 2
+    return sum(1 for line in lines if len(line.encode('utf-8')) > limit)
+
+
+def main(argv):
+    rounds = int(argv[0]) if argv else 5
+    print('%-9s %-7s %9s %7s %9s' % ('sample', 'path', 'seconds', 'lines',
+                                     'overflow'))
+    for name, text in sorted(SAMPLES.items()):
+        msgs = replies(text)
+        for label, func in (('legacy', legacy), ('current', current)):
+            best, lines = None, []
+            for _ in range(rounds):
+                seconds, lines = timeit(func, msgs)
+                best = seconds if best is None else min(best, seconds)
+            print('%-9s %-7s %9.4f %7d %9d'
+                  % (name, label, best, len(lines), overflows(lines)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -16,94 +16,396 @@
 
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import collections
 import re
 import sys
+import time
+
+import gevent
+
 from .components import component_class, observes, msg_parser
 
 if sys.version_info.major == 2:
     str = unicode  # noqa
 
 
+class User(object):
+    """ A nick we share channels with """
+    __slots__ = ('nick', 'key', 'channels')
+
+    def __init__(self, nick, key):
+        self.nick = nick
+        #The one folded copy of the nick every channel uses as its key
+        self.key = key
+        self.channels = set()
+
+
 @component_class('channels')
 class Channels(object):
     """ track channels and stuff """
     def __init__(self, irc_c, config):
+        self.irc_c = irc_c
         self.channels = set()
         self.config = config
         self.db = None
+        #What we persist, written out a little after it stops changing
+        #An ordered set (values unused), autojoin goes in this order
+        self.saved = collections.OrderedDict()
+        self._flusher = None
+        #Membership, channel -> {nick key: prefix symbols}
+        self.tracking = config.members is not False
+        self._members = {}
+        #nick key -> User, the other half of the index
+        self._users = {}
+        #NAMES replies being collected, channel -> {nick key: (nick, modes)}
+        self._names = {}
+        #Join scheduling, channel -> (name, attempts)
+        self._queue = collections.OrderedDict()
+        #channel -> (name, sent at, attempts)
+        self._sent = {}
+        #channel -> (name, retry at, attempts)
+        self._retry = {}
+        self._joiner = None
         print("Channel Management Loaded")
 
     #Provide a little bit of magic
     def __contains__(self, channel):
-        return channel.lower() in self.channels
+        return self.irc_c.casefold(channel) in self.channels
+
+    def members(self, channel):
+        """ Nicks in a channel we are in """
+        users = self._users
+        return [users[key].nick
+                for key in self._members.get(self.irc_c.casefold(channel), ())]
+
+    def common(self, nick):
+        """ Channels we share with nick """
+        user = self._users.get(self.irc_c.casefold(nick))
+        return set(user.channels) if user else set()
+
+    def modes(self, channel, nick):
+        """
+            Prefix symbols (@, +, ...) nick has in channel
+            None if they are not in it
+        """
+        members = self._members.get(self.irc_c.casefold(channel), {})
+        return members.get(self.irc_c.casefold(nick))
+
+    def _user(self, nick):
+        key = self.irc_c.casefold(nick)
+        user = self._users.get(key)
+        if user is None:
+            user = self._users[key] = User(nick, key)
+        return user
+
+    def _add(self, channel, nick, modes=''):
+        user = self._user(nick)
+        self._members[channel][user.key] = modes
+        user.channels.add(channel)
+
+    def _remove(self, channel, key):
+        self._members.get(channel, {}).pop(key, None)
+        self._names.get(channel, {}).pop(key, None)
+        user = self._users.get(key)
+        if user is not None:
+            user.channels.discard(channel)
+            if not user.channels:
+                del self._users[key]
+
+    def _forget(self, channel):
+        """ We left, drop everybody in it """
+        for key in list(self._members.get(channel, ())):
+            self._remove(channel, key)
+        self._members.pop(channel, None)
+        self._names.pop(channel, None)
+
+    def _is_bot(self, irc_c, nick):
+        return irc_c.casefold(nick) == irc_c.casefold(irc_c.botnick)
+
+    def join(self, channels):
+        """ Queue channels to be joined at the configured pace """
+        if isinstance(channels, str):
+            channels = channels.split(',')
+        for name in channels:
+            channel = self.irc_c.casefold(name)
+            if channel in self.channels or channel in self._sent:
+                continue
+            self._retry.pop(channel, None)
+            self._queue.setdefault(channel, (name, 0))
+        if self._queue and (self._joiner is None or self._joiner.dead):
+            #Not in bot_greenlets, shedding it would leave autojoin undone
+            self._joiner = gevent.spawn(self._join_loop, self.irc_c)
+
+    def pending(self):
+        """ Channels we want but have not seen our JOIN for yet """
+        return set(self._queue) | set(self._sent) | set(self._retry)
+
+    def _join_loop(self, irc_c):
+        rate = float(self.config.join_rate or 5)
+        timeout = self.config.join_timeout or 60
+        while self._queue or self._sent or self._retry:
+            now = time.time()
+            #Failed joins come back around once their backoff is up
+            for channel, (name, at, attempts) in list(self._retry.items()):
+                if at <= now:
+                    del self._retry[channel]
+                    self._queue[channel] = (name, attempts)
+            #No answer at all counts as a failure
+            for channel, (name, sent, attempts) in list(self._sent.items()):
+                if now - sent > timeout:
+                    del self._sent[channel]
+                    self._failed(channel, name, attempts, 'timed out')
+            batch = self._next_batch(irc_c)
+            if batch:
+                for channel, name, attempts in batch:
+                    self._sent[channel] = (name, now, attempts)
+                irc_c.JOIN([name for _, name, _ in batch])
+                gevent.sleep(len(batch) / rate)  # Yield
+            else:
+                gevent.sleep(1)  # Yield
+
+    def _next_batch(self, irc_c):
+        """ As many queued channels as fit one JOIN line """
+        limit = self.config.join_batch or 10
+        if irc_c.isupport and irc_c.isupport.targmax.get('JOIN'):
+            limit = min(limit, irc_c.isupport.targmax['JOIN'])
+        batch, size = [], len('JOIN ')
+        while self._queue and len(batch) < limit:
+            channel, (name, attempts) = next(iter(self._queue.items()))
+            length = len(name.encode('utf-8')) + 1
+            if batch and size + length > 511:
+                break
+            del self._queue[channel]
+            batch.append((channel, name, attempts))
+            size += length
+        return batch
+
+    def _failed(self, channel, name, attempts, reason, final=False):
+        attempts += 1
+        if final or attempts >= (self.config.join_attempts or 5):
+            print("Giving up on joining %s: %s" % (name, reason))
+            return
+        delay = min((self.config.join_retry or 30) * 2 ** (attempts - 1),
+                    self.config.join_retry_max or 900)
+        print("Could not join %s (%s), retrying in %ds"
+              % (name, reason, delay))
+        self._retry[channel] = (name, time.time() + delay, attempts)
+
+    @observes('IRC_MSG_403', 'IRC_MSG_405', 'IRC_MSG_471', 'IRC_MSG_473',
+              'IRC_MSG_474', 'IRC_MSG_475', 'IRC_MSG_477', dispatch='inline')
+    def _join_error(self, irc_c, msg):
+        #<botnick> <channel> :Cannot join channel (+l)
+        _, name, reason = (msg.args.split(' ', 2) + ['', ''])[:3]
+        channel = irc_c.casefold(name)
+        if channel in self._sent:
+            name, _, attempts = self._sent.pop(channel)
+            #No such channel won't change by asking again
+            self._failed(channel, name, attempts, reason.lstrip(':'),
+                         final=msg.kind == '403')
+
+    def _changed(self):
+        """ Write saved channels once things settle down """
+        if self._flusher is None:
+            self._flusher = gevent.spawn_later(self.config.db_delay or 5,
+                                               self.flush)
+
+    @observes('IRC_SHUTDOWN')
+    def flush(self, irc_c=None):
+        self._flusher = None
+        if self.db is not None:
+            #Item.commit skips the write if nothing really changed
+            self.db.value = list(self.saved)
+            self.db.commit()
+
+    @observes('IRC_SOCKET_CONNECT', dispatch='inline')
+    def _reset(self, irc_c):
+        #Joins for the old connection stop with it
+        if self._joiner is not None:
+            self._joiner.kill()
+            self._joiner = None
+        self._queue.clear()
+        self._sent.clear()
+        self._retry.clear()
 
     @observes('IRC_ONCONNECT')
     def _autojoin(self, irc_c):
         self.channels.clear()
+        self._members.clear()
+        self._users.clear()
+        self._names.clear()
         if self.config.autojoin:
             if isinstance(self.config.autojoin, str):
                 self.config.autojoin = self.config.autojoin.split(',')
-            if self.config.db and irc_c.db:
+            if self.config.db and irc_c.db and self.db is None:
                 print("Loading Channels from DB")
                 self.db = irc_c.db.get('channels', 'autojoin')
-                if self.db.value:
-                    merge = list(set(self.db.value + self.config.autojoin))
-                    self.config.autojoin = merge
-                else:
-                    self.db.value = []
-                self.db.value = sorted(self.config.autojoin)
-                self.db.commit()
+                #Configured channels first in their order, then the db's
+                for channel in list(self.config.autojoin) + list(
+                        self.db.value or []):
+                    self.saved.setdefault(irc_c.casefold(channel))
+                self.config.autojoin = list(self.saved)
+                self._changed()
+            elif self.db is not None:
+                self.config.autojoin = list(self.saved)
             print("Channels Auto Joining: %r" % self.config.autojoin)
-            irc_c.JOIN(self.config.autojoin)
+            self.join(self.config.autojoin)
 
     @msg_parser('JOIN')
     def _join_parser(self, msg, irc_c):
-        msg.raw_channel = re.sub(r'^:', '', msg.args.strip())
-        msg.channel = msg.raw_channel.lower()
+        #extended-join adds account and realname after the channel
+        msg.raw_channel = msg.args.strip().split(' ', 1)[0].lstrip(':')
+        msg.channel = irc_c.casefold(msg.raw_channel)
         msg.reply = lambda text: irc_c.PRIVMSG(msg.channel, text)
 
     @msg_parser('PART')
     def _part_parser(self, msg, irc_c):
         msg.raw_channel, _, message = msg.args.strip().partition(' ')
-        msg.channel = msg.raw_channel.lower()
+        msg.channel = irc_c.casefold(msg.raw_channel)
         msg.message = re.sub(r'^:', '', message)
         msg.reply = lambda text: irc_c.PRIVMSG(msg.channel, text)
 
     @msg_parser('KICK')
     def _kick_parser(self, msg, irc_c):
         msg.raw_channel, msg.victim, message = msg.args.split(' ', 2)
-        msg.channel = msg.raw_channel.lower()
+        msg.channel = irc_c.casefold(msg.raw_channel)
         msg.message = re.sub(r'^:', '', message)
         msg.reply = lambda text: irc_c.PRIVMSG(msg.channel, text)
 
     @msg_parser('332')
     def _topic_parser(self, msg, irc_c):
         _, msg.raw_channel, message = msg.args.split(' ', 2)
-        msg.channel = msg.raw_channel.lower()
+        msg.channel = irc_c.casefold(msg.raw_channel)
         msg.message = re.sub(r'^:', '', message)
         msg.reply = lambda text: irc_c.PRIVMSG(msg.channel, text)
 
-    @observes('IRC_MSG_JOIN')
+    @observes('IRC_MSG_JOIN', dispatch='inline')
     def _join(self, irc_c, msg):
+        if self.tracking:
+            if self._is_bot(irc_c, msg.nick):
+                self._forget(msg.channel)
+                self._members[msg.channel] = {}
+            if msg.channel in self._members:
+                self._add(msg.channel, msg.nick)
         #Only Our Joins
-        if msg.nick.lower() == irc_c.botnick.lower():
+        if self._is_bot(irc_c, msg.nick):
             self.channels.add(msg.channel)
-            if self.db and msg.channel not in self.db.value:
-                self.db.value.append(msg.channel)
-                self.db.value.sort()
-                self.db.commit()
+            self._sent.pop(msg.channel, None)
+            self._queue.pop(msg.channel, None)
+            self._retry.pop(msg.channel, None)
+            if self.db and msg.channel not in self.saved:
+                self.saved[msg.channel] = None
+                self._changed()
 
-    @observes('IRC_MSG_PART')
+    @observes('IRC_MSG_PART', dispatch='inline')
     def _part(self, irc_c, msg):
+        if self.tracking:
+            if self._is_bot(irc_c, msg.nick):
+                self._forget(msg.channel)
+            else:
+                self._remove(msg.channel, irc_c.casefold(msg.nick))
         #Only Our Parts
-        if msg.nick.lower() == irc_c.botnick.lower():
+        if self._is_bot(irc_c, msg.nick):
             self.channels.remove(msg.channel)
-            if self.db and msg.channel in self.db.value:
-                self.db.value.remove(msg.channel)
-                self.db.value.sort()
-                self.db.commit()
+            if self.db and msg.channel in self.saved:
+                del self.saved[msg.channel]
+                self._changed()
 
-    @observes('IRC_MSG_KICK')
+    @observes('IRC_MSG_KICK', dispatch='inline')
     def _kick(self, irc_c, msg):
-        if irc_c.botnick.lower() == msg.victim.lower():
+        if self.tracking:
+            if self._is_bot(irc_c, msg.victim):
+                self._forget(msg.channel)
+            else:
+                self._remove(msg.channel, irc_c.casefold(msg.victim))
+        if self._is_bot(irc_c, msg.victim):
             self.channels.remove(msg.channel)
+
+    @observes('IRC_MSG_QUIT', dispatch='inline')
+    def _quit(self, irc_c, msg):
+        key = irc_c.casefold(msg.nick or '')
+        #They may only be in a NAMES reply we haven't finished yet
+        for collected in self._names.values():
+            collected.pop(key, None)
+        user = self._users.get(key)
+        if user is not None:
+            for channel in list(user.channels):
+                self._remove(channel, user.key)
+
+    @observes('IRC_NICK_CHANGE', dispatch='inline')
+    def _nick(self, irc_c, old, new):
+        old_key, key = irc_c.casefold(old), irc_c.casefold(new)
+        for collected in self._names.values():
+            if old_key in collected:
+                collected[key] = (new, collected.pop(old_key)[1])
+        user = self._users.pop(old_key, None)
+        if user is None:
+            return
+        for channel in user.channels:
+            members = self._members[channel]
+            members[key] = members.pop(user.key)
+        user.nick, user.key = new, key
+        self._users[key] = user
+
+    @observes('IRC_MSG_353', dispatch='inline')
+    def _names_reply(self, irc_c, msg):
+        #<botnick> [=*@] <channel> :[prefix]nick[!user@host] ...
+        header, _, names = msg.args.partition(' :')
+        channel = irc_c.casefold(header.split(' ')[-1])
+        if channel not in self._members:
+            return
+        symbols = irc_c.isupport.prefix_symbols if irc_c.isupport else '@+'
+        collected = self._names.setdefault(channel, {})
+        for name in names.split():
+            nick = name.lstrip(symbols)
+            modes = name[:len(name) - len(nick)]
+            #userhost-in-names
+            nick = nick.split('!', 1)[0]
+            collected[irc_c.casefold(nick)] = (nick, modes)
+
+    @observes('IRC_MSG_366', dispatch='inline')
+    def _names_end(self, irc_c, msg):
+        #NAMES is the whole truth, swap it in
+        channel = irc_c.casefold(msg.args.split(' ')[1])
+        collected = self._names.pop(channel, None)
+        if collected is None or channel not in self._members:
+            return
+        for key in set(self._members[channel]) - set(collected):
+            self._remove(channel, key)
+        members = {}
+        for nick, modes in collected.values():
+            user = self._user(nick)
+            user.channels.add(channel)
+            members[user.key] = modes
+        self._members[channel] = members
+
+    @observes('IRC_MSG_MODE', dispatch='inline')
+    def _mode(self, irc_c, msg):
+        parts = msg.args.split(' ')
+        channel = irc_c.casefold(parts[0])
+        members = self._members.get(channel)
+        if members is None or len(parts) < 2:
+            return
+        isupport = irc_c.isupport
+        prefix = isupport.prefix if isupport else {'o': '@', 'v': '+'}
+        chanmodes = isupport.chanmodes if isupport else ('b', 'k', 'l', '')
+        params = [param.lstrip(':') for param in parts[2:]]
+        adding = True
+        for mode in parts[1].lstrip(':'):
+            if mode in '+-':
+                adding = mode == '+'
+            elif mode in prefix:
+                key = irc_c.casefold(params.pop(0)) if params else None
+                if key not in members:
+                    continue
+                symbol = prefix[mode]
+                current = members[key].replace(symbol, '')
+                if adding:
+                    #Keep symbols in rank order like multi-prefix does
+                    current = ''.join(s for s in prefix.values()
+                                      if s in current or s == symbol)
+                members[key] = current
+            elif mode in chanmodes[0] or mode in chanmodes[1] \
+                    or (adding and mode in chanmodes[2]):
+                #Takes a parameter we don't care about
+                if params:
+                    params.pop(0)
@@ -27,6 +27,7 @@ import gevent
 
 from .util.decorator import EasyDecorator
 from .irc import Message
+from .events import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 
 if sys.version_info.major == 2:
     str = unicode  # noqa
@@ -36,6 +37,7 @@ __all__ = ['component_class',
            'watches', 'observe', 'observes', 'handle', 'handles',
            'every',
            'triggers_on', 'keyword', 'keywords', 'trigger', 'triggers',
+           'PRIORITY_HIGH', 'PRIORITY_NORMAL', 'PRIORITY_LOW',
            'ComponentManager']
 
 #Used to mark classes for later inspection
@@ -70,6 +72,16 @@ def _requires(*names):
 component_class.requires = _requires
 
 
+def _capabilities(*caps):
+    """ IRCv3 capabilities the class needs the client to negotiate """
+    def wrapper(cls):
+        cls.__capabilities__ = caps
+        return cls
+    return wrapper
+
+component_class.capabilities = _capabilities
+
+
 def _get_plugs(method, kind):
     """ Setup a place to put plugin hooks, allowing only one type per func """
     if not hasattr(method, '__plugs__'):
@@ -96,11 +108,22 @@ def msg_parser(*kinds, **kwargs):
     return wrapper
 
 
-def watches(*events):
-    """ Define a series of events to later be subscribed to """
+def watches(*events, **kwargs):
+    """
+        Define a series of events to later be subscribed to
+        dispatch='inline'|'pooled'|'spawn' picks how the observer is run
+        priority=PRIORITY_HIGH|NORMAL|LOW overrides the event's priority
+    """
+    dispatch = kwargs.pop('dispatch', None)
+    priority = kwargs.pop('priority', None)
+
     def wrapper(func):
         eplugs = _get_plugs(func, 'events')
         eplugs.extend([event for event in events if event not in eplugs])
+        if dispatch:
+            func.__dispatch__ = dispatch
+        if priority is not None:
+            func.__priority__ = priority
         return func
     return wrapper
 observes = watches
@@ -128,6 +151,15 @@ class _Ignore(EasyDecorator):
 watches.ignore = _Ignore
 
 
+def _channel_allowed(irc_c, channel, allowed):
+    """ msg.channel is casefolded, so fold a channel or channels to match """
+    if isinstance(allowed, str):
+        return channel == irc_c.casefold(allowed)
+    elif isinstance(allowed, collections.Container):
+        return any(channel == irc_c.casefold(name) for name in allowed)
+    return False
+
+
 class _Channel(EasyDecorator):
     """Ignore triggers not in channels, or optionally a list of channels"""
     def wrapper(dec, irc_c, msg, *args):
@@ -135,19 +167,13 @@ class _Channel(EasyDecorator):
             #Did they want to restrict which channels
             #Should we lookup allowed channels at run time
             if dec.args and dec.kwargs.get('runtime'):
-                ok = False
-                for attr in dec.args:
-                    if hasattr(dec._instance, attr):
-                        channel = getattr(dec._instance, attr)
-                        if isinstance(channel, str)\
-                                and msg.channel == channel:
-                            ok = True
-                        elif isinstance(channel, collections.Container)\
-                                and msg.channel in channel:
-                            ok = True
-                if not ok:
+                if not any(_channel_allowed(irc_c, msg.channel,
+                                            getattr(dec._instance, attr))
+                           for attr in dec.args
+                           if hasattr(dec._instance, attr)):
                     return
-            elif dec.args and msg.channel not in dec.args:
+            elif dec.args and not _channel_allowed(irc_c, msg.channel,
+                                                   dec.args):
                 return
             return dec.call(irc_c, msg, *args)
 watches.channel = _Channel
@@ -182,19 +208,13 @@ class triggers_on(object):
                 # Did they want to restrict which channels
                 # Should we lookup allowed channels at run time
                 if dec.args and dec.kwargs.get('runtime'):
-                    ok = False
-                    for attr in dec.args:
-                        if hasattr(dec._instance, attr):
-                            channel = getattr(dec._instance, attr)
-                            if isinstance(channel, str)\
-                                    and msg.channel.lower() == channel:
-                                ok = True
-                            elif isinstance(channel, collections.Container)\
-                                    and msg.channel.lower() in channel:
-                                ok = True
-                    if not ok:
+                    if not any(_channel_allowed(irc_c, msg.channel,
+                                                getattr(dec._instance, attr))
+                               for attr in dec.args
+                               if hasattr(dec._instance, attr)):
                         return
-                elif dec.args and msg.channel not in dec.args:
+                elif dec.args and not _channel_allowed(irc_c, msg.channel,
+                                                       dec.args):
                     return
             elif not dec.kwargs.get('private'):
                 return
@@ -368,6 +388,10 @@ class ComponentManager(object):
                 if hasattr(member, '__requires__'):
                     for req in member.__requires__:
                         self._require(req)
+                #Let the client know what capabilities to ask for
+                if hasattr(member, '__capabilities__'):
+                    context.setdefault('cap_requests', set()).update(
+                        member.__capabilities__)
                 obj = member(context, config)
                 #Save the context for this obj if the class_marker is a str
                 context_name = getattr(obj, class_marker)
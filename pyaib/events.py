@@ -17,28 +17,205 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import collections
+import traceback
+
 import gevent
 import gevent.pool
 
 from . import irc
 
 
+#Event priorities, lower goes first and is shed last
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+#Protocol events the bot can't fall behind on, everything else is normal
+PRIORITIES = {
+    'irc_msg_ping': PRIORITY_HIGH,
+    'irc_msg_001': PRIORITY_HIGH,
+    'irc_msg_433': PRIORITY_HIGH,
+    'irc_msg_nick': PRIORITY_HIGH,
+    'irc_msg_error': PRIORITY_HIGH,
+    #What the client hooks fire for them
+    'irc_onconnect': PRIORITY_HIGH,
+    'irc_nick_inuse': PRIORITY_HIGH,
+    'irc_nick_change': PRIORITY_HIGH,
+    #Membership churn goes first when the pool fills up
+    'irc_msg_join': PRIORITY_LOW,
+    'irc_msg_part': PRIORITY_LOW,
+    'irc_msg_quit': PRIORITY_LOW,
+    'irc_msg_353': PRIORITY_LOW,
+    'irc_msg_366': PRIORITY_LOW,
+    'irc_reply_names': PRIORITY_LOW,
+}
+
+
+class BotGreenlets(gevent.pool.Pool):
+    """
+        irc_c.bot_greenlets, bounded with a policy for when it fills up
+            block: wait for room, the reader stops reading (backpressure)
+            drop: drop new work till there is room again
+            priority: low priority work is dropped first, then normal
+        High priority work is never capped, dropped or made to wait
+    """
+    #Share of the pool low priority work may fill under the priority policy
+    LOW_PRIORITY_SHARE = 0.8
+
+    def __init__(self, irc_c, size=1000, policy='priority'):
+        gevent.pool.Pool.__init__(self, size or None)
+        self.irc_c = irc_c
+        self.policy = policy
+        self.shedding = False
+        #Counters
+        self.dropped = 0
+        self.overloads = 0
+        self.peak = 0
+        self._notifying = False
+        #High priority and overload work, outside the cap
+        self.urgent = gevent.pool.Group()
+
+    def spawn(self, func, *args, **kwargs):
+        return self.submit(PRIORITY_NORMAL, func, *args, **kwargs)
+
+    def submit(self, priority, func, *args, **kwargs):
+        """ spawn with a priority to decide what gets shed """
+        if self._notifying or priority <= PRIORITY_HIGH:
+            #Protocol work and IRC_OVERLOAD observers never wait on the pool
+            return self.urgent.spawn(func, *args, **kwargs)
+        if self.size is not None and self._shed(priority):
+            self.dropped += 1
+            if not self.shedding:
+                self.shedding = True
+                self.overloads += 1
+                gevent.spawn(self._notify, True)
+            return None
+        greenlet = gevent.pool.Pool.spawn(self, func, *args, **kwargs)
+        self.peak = max(self.peak, len(self))
+        return greenlet
+
+    def _shed(self, priority):
+        if self.policy == 'block':
+            return False
+        if self.policy == 'priority' and priority >= PRIORITY_LOW:
+            return len(self) >= int(self.size * self.LOW_PRIORITY_SHARE)
+        return len(self) >= self.size
+
+    #Pool links this to every greenlet it runs
+    def _discard(self, greenlet):
+        gevent.pool.Pool._discard(self, greenlet)
+        #Back to half full is over the overload
+        if self.shedding and len(self) <= self.size // 2:
+            self.shedding = False
+            gevent.spawn(self._notify, False)
+
+    def join(self, timeout=None, raise_error=False):
+        self.urgent.join(timeout, raise_error)
+        return gevent.pool.Pool.join(self, timeout, raise_error)
+
+    def kill(self, *args, **kwargs):
+        self.urgent.kill(*args, **kwargs)
+        gevent.pool.Pool.kill(self, *args, **kwargs)
+
+    def _notify(self, overloaded):
+        print("Greenlet pool %s: %r" % ('overloaded, shedding work'
+                                        if overloaded else 'recovered',
+                                        self.stats()))
+        self._notifying = True
+        try:
+            self.irc_c.events['IRC_OVERLOAD'](self.irc_c, overloaded,
+                                              self.stats())
+        finally:
+            self._notifying = False
+
+    def stats(self):
+        return {'running': len(self), 'urgent': len(self.urgent),
+                'size': self.size, 'policy': self.policy,
+                'shedding': self.shedding,
+                'dropped': self.dropped, 'overloads': self.overloads,
+                'peak': self.peak}
+
+
 class Event(object):
     """ An Event Handler """
-    def __init__(self):
+    #How observers get run
+    #  inline: right away in the reader loop, must be quick and never block
+    #  pooled: on the bounded irc_c.bot_pool
+    #  spawn: a greenlet of its own in irc_c.bot_greenlets (the default)
+    DISPATCH_MODES = ('inline', 'pooled', 'spawn')
+
+    def __init__(self, changed=None, name=None, wrap=None):
+        self.name = name
         self.__observers = []
+        self.__dispatch = {}
+        #Observers with their own priority, the rest get the event's
+        self.__priorities = {}
+        #Called when observers come or go, Events rebuilds its table
+        self.__changed = changed
+        #Instrumentation, wrap(event name, observer) -> callable
+        self.__wrap = wrap
+        #How much this event matters when the pool is full
+        self.__priority = PRIORITY_NORMAL
+        #Split up by dispatch mode so fire doesn't have to look
+        self.__inline = ()
+        self.__pooled = ()
+        self.__spawn = ()
 
-    def observe(self, observer):
+    @property
+    def priority(self):
+        return self.__priority
+
+    @priority.setter
+    def priority(self, priority):
+        self.__priority = priority
+        self._rebuild()
+
+    def observe(self, observer, dispatch=None, priority=None):
         if isinstance(observer, collections.Callable):
+            dispatch = dispatch or getattr(observer, '__dispatch__', 'spawn')
+            if dispatch not in self.DISPATCH_MODES:
+                print("Event Error: unknown dispatch %r for %s, spawning"
+                      % (dispatch, repr(observer)))
+                dispatch = 'spawn'
+            if priority is None:
+                priority = getattr(observer, '__priority__', None)
             self.__observers.append(observer)
+            self.__dispatch[observer] = dispatch
+            if priority is not None:
+                self.__priorities[observer] = priority
+            self._rebuild()
         else:
             print("Event Error: %s not callable" % repr(observer))
         return self
 
     def unobserve(self, observer):
         self.__observers.remove(observer)
+        if observer not in self.__observers:
+            self.__dispatch.pop(observer, None)
+            self.__priorities.pop(observer, None)
+        self._rebuild()
         return self
 
+    def instrument(self, wrap):
+        """ Run every observer through wrap(event name, observer) """
+        self.__wrap = wrap
+        self._rebuild()
+
+    def _rebuild(self):
+        modes = dict((mode, []) for mode in self.DISPATCH_MODES)
+        #Higher priority observers run (or get spawned) first
+        for observer in sorted(self.__observers, key=self.observerPriority):
+            runner = observer
+            if self.__wrap is not None:
+                runner = self.__wrap(self.name, observer)
+            modes[self.__dispatch[observer]].append(
+                (self.observerPriority(observer), runner))
+        self.__inline = tuple(runner for _, runner in modes['inline'])
+        self.__pooled = tuple(modes['pooled'])
+        self.__spawn = tuple(modes['spawn'])
+        if self.__changed is not None:
+            self.__changed()
+
     def fire(self, *args, **keywargs):
         #Pull the irc_c from the args
         irc_c = args[0]
@@ -47,20 +224,34 @@ class Event(object):
             #Maybe DIE here
             return
 
-        for observer in self.__observers:
-            if isinstance(observer, collections.Callable):
-                irc_c.bot_greenlets.spawn(observer, *args, **keywargs)
+        for observer in self.__inline:
+            try:
+                observer(*args, **keywargs)
+            except Exception:
+                #Never let a handler take down the reader
+                traceback.print_exc()
+        for priority, observer in self.__pooled:
+            #Protocol work doesn't wait behind a full pool of plugin work
+            if priority <= PRIORITY_HIGH and irc_c.bot_pool.full():
+                irc_c.bot_greenlets.submit(priority, observer, *args,
+                                           **keywargs)
             else:
-                print("Event Error: %s not callable" % repr(observer))
+                irc_c.bot_pool.spawn(observer, *args, **keywargs)
+        for priority, observer in self.__spawn:
+            irc_c.bot_greenlets.submit(priority, observer, *args,
+                                       **keywargs)
 
     def clearObjectObservers(self, inObject):
-        for observer in self.__observers:
-            if observer.__self__ == inObject:
+        for observer in list(self.__observers):
+            if getattr(observer, '__self__', None) == inObject:
                 self.unobserve(observer)
 
     def getObserverCount(self):
         return len(self.__observers)
 
+    def observerPriority(self, observer):
+        return self.__priorities.get(observer, self.__priority)
+
     def observers(self):
         return self.__observers
 
@@ -76,12 +267,37 @@ class Event(object):
 
 class Events(object):
     """ Manage events allow observers before events are defined"""
+    #Exact name lookups remembered before the cache starts over
+    CACHE_SIZE = 1024
+    #Config may name priorities instead of using the numbers
+    PRIORITY_NAMES = {'high': PRIORITY_HIGH, 'normal': PRIORITY_NORMAL,
+                      'low': PRIORITY_LOW}
+
     def __init__(self, irc_c):
         self.__events = {}
         self.__nullEvent = NullEvent()
+        #Exact name -> Event, saves lowercasing names we have seen
+        self.__names = {}
+        #Message kind -> Events to fire for it, built when first needed
+        self.__table = None
+        self.__generic = ()
+        #Instrumentation for new and existing events
+        self.__wrap = None
+        #Event name -> priority, config events.priorities adds to these
+        self.__priorities = dict(PRIORITIES)
         #A place to track all the running events
-        #Events load first so this seems logical
-        irc_c.bot_greenlets = gevent.pool.Group()
+        #Events load first so this seems logical, Triggers reuse them
+        if 'bot_greenlets' not in irc_c:
+            config = irc_c.config.events
+            irc_c.bot_greenlets = BotGreenlets(
+                irc_c, config.max_greenlets if 'max_greenlets' in config
+                else 1000, config.overflow or 'priority')
+            #Bounded workers for pooled observers, full means the reader waits
+            irc_c.bot_pool = gevent.pool.Pool(config.pool_size or 64)
+        for name, priority in (irc_c.config.events.priorities or {}).items():
+            if priority in self.PRIORITY_NAMES:
+                priority = self.PRIORITY_NAMES[priority]
+            self.__priorities[name.lower()] = int(priority)
 
     def list(self):
         return self.__events.keys()
@@ -92,17 +308,55 @@ class Events(object):
     def getOrMake(self, name):
         if not self.isEvent(name):
             #Make Event if it does not exist
-            self.__events[name.lower()] = Event()
+            event = Event(self._changed, name, self.__wrap)
+            event.priority = self.__priorities.get(name.lower(),
+                                                   PRIORITY_NORMAL)
+            self.__events[name.lower()] = event
+            self._changed()
         return self.get(name)
 
     #Do not create the event on a simple get
     #Return the null event on non existent events
     def get(self, name):
+        event = self.__names.get(name)
+        if event is not None:
+            return event
         event = self.__events.get(name.lower())
         if event is None:  # Only on undefined events
             return self.__nullEvent
+        if len(self.__names) >= self.CACHE_SIZE:
+            self.__names.clear()
+        self.__names[name] = event
         return event
 
+    def instrument(self, wrap):
+        """ Run all observers through wrap(event name, observer) """
+        self.__wrap = wrap
+        for event in self.__events.values():
+            event.instrument(wrap)
+
+    def _changed(self):
+        self.__table = None
+
+    def _build(self):
+        """ Message kind -> (IRC_MSG_<kind>, IRC_MSG) with observers """
+        generic = self.__events.get('irc_msg')
+        self.__generic = (generic,) if generic else ()
+        table = {}
+        for name, event in self.__events.items():
+            if name.startswith('irc_msg_') and event:
+                table[name[8:].upper()] = (event,) + self.__generic
+        self.__table = table
+        return table
+
+    def fire_message(self, irc_c, msg):
+        """ Fire IRC_MSG_<kind> then IRC_MSG for a message """
+        table = self.__table
+        if table is None:
+            table = self._build()
+        for event in table.get(msg.kind, self.__generic):
+            event.fire(irc_c, msg)
+
     __contains__ = isEvent
     __call__ = getOrMake
     __getitem__ = get
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Outbound flood control
+
+Lines are paced out with a token bucket so the server never sees more than
+'burst' lines at once or more than 'rate' lines a second over time.
+Protocol traffic jumps the queue, everything else is round-robin by target
+so one noisy channel can't starve the rest.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import collections
+import time
+
+from gevent.event import Event
+
+
+class FloodControl(object):
+    """ Token bucket scheduler between Context.RAW and the LineSocket """
+    #Commands that go out ahead of everything else
+    PRIORITY = frozenset(['PONG', 'PING', 'NICK', 'QUIT', 'PASS', 'USER',
+                          'CAP', 'AUTHENTICATE'])
+    #Commands that get round-robin by target
+    TARGETED = frozenset(['PRIVMSG', 'NOTICE'])
+
+    def __init__(self, config):
+        #Lines allowed in a burst, and lines per second after that
+        #A rate of 0 turns off flood control
+        self.burst = float(config.get('burst', 5))
+        self.rate = float(config.get('rate', 2))
+        self.tokens = self.burst
+        self.updated = time.time()
+
+        self._priority = collections.deque()
+        #target -> deque of lines, and the order targets get served in
+        self._targets = {}
+        self._order = collections.deque()
+        self._wakeup = Event()
+        #Cuts a wait for tokens short when protocol traffic shows up
+        self._urgent = Event()
+
+        #Counters
+        self.sent = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    def put(self, line):
+        """ Queue up a line for sending """
+        command, _, rest = line.partition(' ')
+        command = command.upper()
+        item = (time.time(), line)
+        if command in self.PRIORITY:
+            self._priority.append(item)
+            self._urgent.set()
+        else:
+            #Everything not targeted shares the '' target
+            target = rest.partition(' ')[0] if command in self.TARGETED \
+                else ''
+            queue = self._targets.get(target)
+            if queue is None:
+                queue = self._targets[target] = collections.deque()
+                self._order.append(target)
+            queue.append(item)
+        self._wakeup.set()
+
+    def clear(self):
+        """ Drop anything queued, used between connections """
+        self._priority.clear()
+        self._targets.clear()
+        self._order.clear()
+        self.tokens = self.burst
+        self.updated = time.time()
+
+    def depth(self):
+        """ Number of lines waiting to be sent """
+        return len(self._priority) + sum(len(queue) for queue
+                                         in self._targets.values())
+
+    def stats(self):
+        """ Queue depth and wait counters """
+        return {'depth': self.depth(),
+                'targets': len(self._targets),
+                'sent': self.sent,
+                'wait_total': self.waited,
+                'wait_max': self.max_wait,
+                'wait_avg': self.waited / self.sent if self.sent else 0.0}
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _next(self):
+        """ Pop the next line honoring priority and per target fairness """
+        if self._priority:
+            return self._priority.popleft()
+        target = self._order.popleft()
+        queue = self._targets[target]
+        item = queue.popleft()
+        if queue:
+            self._order.append(target)  # Back of the line
+        else:
+            del self._targets[target]
+        return item
+
+    def run(self, sock):
+        """ Feed queued lines to the socket as fast as the bucket allows """
+        while True:
+            if not self._priority and not self._order:
+                self._wakeup.clear()
+                self._wakeup.wait()  # Yield
+                continue
+
+            if self.rate:
+                self._refill()
+                if self.tokens < 1 and not self._priority:
+                    self._urgent.clear()
+                    self._urgent.wait((1 - self.tokens) / self.rate)  # Yield
+                    continue
+
+            #Take as much as the bucket allows in one go
+            #Protocol traffic never waits but still spends tokens
+            batch = []
+            now = time.time()
+            while self._priority or (self._order and (
+                    not self.rate or self.tokens >= 1)):
+                queued, line = self._next()
+                if self.rate:
+                    self.tokens -= 1
+                wait = now - queued
+                self.sent += 1
+                self.waited += wait
+                self.max_wait = max(self.max_wait, wait)
+                batch.append(line)
+            sock.writelines(batch)
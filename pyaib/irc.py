@@ -16,15 +16,21 @@
 
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import base64
+import calendar
+import collections
+import functools
+import random
 import re
 import sys
-from textwrap import wrap
 import traceback
 import time
 
 import gevent
+import gevent.queue
 
-from .linesocket import LineSocket
+from .linesocket import LineSocket, race
+from .flood import FloodControl
 from .util import data
 from .util.decorator import raise_exceptions
 from . import __version__ as pyaib_version
@@ -34,6 +40,81 @@ if sys.version_info.major == 2:
 
 MAX_LENGTH = 510
 
+#Outbound clean up, line breaks are dropped and tabs become 4 spaces
+SANITIZE = {ord('\r'): None, ord('\n'): None, ord('\t'): '    '}
+#Before wrapping any whitespace is a plain space like textwrap did
+WRAP_WHITESPACE = {ord('\r'): ' ', ord('\n'): ' ', ord('\t'): '    ',
+                   ord('\v'): ' ', ord('\f'): ' '}
+#Words and runs of spaces
+WRAP_CHUNK_REGEX = re.compile(r' +|[^ ]+')
+#Pieces a long word can be broken between, keeps color codes whole
+WRAP_ATOM_REGEX = re.compile(r'\x03(?:\d{1,2}(?:,\d{1,2})?)?'
+                             r'|\x04(?:[0-9a-fA-F]{6}(?:,[0-9a-fA-F]{6})?)?'
+                             r'|.', re.S)
+
+#IRCv3 capabilities requested when irc.capabilities is not configured
+#Only what the core uses itself, ones that change what plugins parse
+#(multi-prefix, userhost-in-names, ...) have to be asked for
+DEFAULT_CAPABILITIES = ('server-time', 'batch')
+
+
+def wrap(text, width, encoding='utf-8'):
+    """
+        Greedy word wrap into lines of at most width encoded bytes
+        Long words are broken between characters but never inside a
+        color code, spaces at line breaks are dropped
+    """
+    #Most replies fit, don't bother splitting them up
+    if len(text) * 4 <= width \
+            or len(text.encode(encoding, 'replace')) <= width:
+        text = text.strip(' ')
+        return [text] if text else []
+    lines, line, size = [], [], 0
+    for chunk in WRAP_CHUNK_REGEX.findall(text):
+        length = len(chunk.encode(encoding, 'replace'))
+        if size + length <= width:
+            if line or chunk[0] != ' ':
+                line.append(chunk)
+                size += length
+            continue
+        if line:
+            lines.append(''.join(line).rstrip(' '))
+            line, size = [], 0
+        if chunk[0] == ' ':
+            continue
+        if length <= width:
+            line, size = [chunk], length
+            continue
+        #Too big for any line, break it up
+        for atom in WRAP_ATOM_REGEX.findall(chunk):
+            length = len(atom.encode(encoding, 'replace'))
+            if size + length > width and line:
+                lines.append(''.join(line))
+                line, size = [], 0
+            line.append(atom)
+            size += length
+    if line:
+        lines.append(''.join(line).rstrip(' '))
+    return [line for line in lines if line]
+
+
+#Encoded length of ':<botmask> <command> <target> :' by those three
+_prefix_lengths = {}
+
+
+def prefix_length(sender, command, target, encoding='utf-8'):
+    key = (sender, command, target)
+    length = _prefix_lengths.get(key)
+    if length is None:
+        if len(_prefix_lengths) >= 1024:
+            _prefix_lengths.clear()
+        # + 2 because of leading : and space after nickmask
+        length = len(sender.encode(encoding)) + 2 + \
+            len(('%s %s :' % (command, target)).encode(encoding))
+        _prefix_lengths[key] = length
+    return length
+
+
 #Class for storing irc related information
 class Context(data.Object):
     """Dummy Object to hold irc data and send messages"""
@@ -49,9 +130,9 @@ class Context(data.Object):
             #Raw Send but don't allow empty spam
             if message is not None:
                 #Clean up messages
-                message = re.sub(r'[\r\n]', '', message).expandtabs(4).rstrip()
+                message = message.translate(SANITIZE).rstrip()
                 if len(message):
-                    self.client.socket.writeline(message)
+                    self.client.flood.put(message)
                     #Fire raw send event for debug if exists [] instead of ()
                     self.events['IRC_RAW_SEND'](self, message)
         except TypeError:
@@ -80,30 +161,91 @@ class Context(data.Object):
         if isinstance(msg, (list, tuple, set)):
             msg = ' '.join(msg)
         msgtemplate = '%s %s :%%s' % (command, target)
-        # length of self.botsender.raw is 0 when not set :P
-        # + 2 because of leading : and space after nickmask
-        prefix_length = len(self.botsender.raw) + 2 + len(msgtemplate % '')
-        for line in wrap(msg, MAX_LENGTH - prefix_length):
+        # botsender is empty till we have seen ourselves
+        length = prefix_length(self.botsender.raw or '', command, target)
+        msg = msg.translate(WRAP_WHITESPACE)
+        for line in wrap(msg, MAX_LENGTH - length):
             yield msgtemplate % line
 
+    def casefold(self, name):
+        """ Normalize a nick or channel with the server's CASEMAPPING """
+        if self.isupport:
+            return self.isupport.casefold(name)
+        return name.lower()
+
+    def broadcast(self, targets, msg, command='PRIVMSG'):
+        """
+            Send msg to many targets, as many per line as the server allows
+            The body is wrapped once and shared by every group of targets
+        """
+        if isinstance(targets, str):
+            targets = targets.split(',')
+        targets = list(collections.OrderedDict.fromkeys(targets))
+        if not targets:
+            return
+        if isinstance(msg, (list, tuple, set)):
+            msg = ' '.join(msg)
+        limit = self.isupport.target_limit(command) if self.isupport else 1
+        #Room for the biggest group we might send
+        if limit:
+            longest = sorted(targets, key=len)[-limit:]
+            room = len(','.join(longest).encode('utf-8'))
+        else:
+            room = min(len(','.join(targets).encode('utf-8')),
+                       MAX_LENGTH // 2)
+        length = prefix_length(self.botsender.raw or '', command, '') + room
+        lines = wrap(msg.translate(WRAP_WHITESPACE), MAX_LENGTH - length)
+        #Pack targets into groups that fit the room
+        groups, group, size = [], [], -1
+        for target in targets:
+            tlen = len(target.encode('utf-8')) + 1
+            if group and (size + tlen > room
+                          or (limit and len(group) >= limit)):
+                groups.append(group)
+                group, size = [], -1
+            group.append(target)
+            size += tlen
+        groups.append(group)
+        for group in groups:
+            msgtemplate = '%s %s :%%s' % (command, ','.join(group))
+            for line in lines:
+                self.RAW(msgtemplate % line)
+
     def JOIN(self, channels):
         if isinstance(channels, (list, set, tuple)):
             channels = list(channels)
         else:
             channels = [channels]
-
-        join = 'JOIN '
-        msg = join
+        #No TARGMAX entry means pack them in, JOIN always took lists
+        limit = self.isupport.targmax.get('JOIN') if self.isupport else None
 
         # Build up join messages (wrap won't work)
-        while channels:
-            channel = channels.pop() + ','
-            if len(msg + channel) > MAX_LENGTH:
-                self.RAW(msg.rstrip(','))
-                msg = join
-            msg += channel
-
-        self.RAW(msg.rstrip(','))
+        join, size = [], len('JOIN ')
+        for channel in channels:
+            length = len(channel.encode('utf-8')) + 1  # and a comma
+            if join and (size + length > MAX_LENGTH + 1
+                         or (limit and len(join) >= limit)):
+                self.RAW('JOIN %s' % ','.join(join))
+                join, size = [], len('JOIN ')
+            join.append(channel)
+            size += length
+        if join:
+            self.RAW('JOIN %s' % ','.join(join))
+
+    def LIST(self, channels=None, buffer=1000):
+        """
+            Iterate ListEntry(channel, users, topic) as the server sends them
+            Only buffer entries are held, so 50k channel lists are fine, a
+            stream that falls further behind than that is cut short
+        """
+        stream = self.client.replies.stream('LIST', buffer)
+        if channels:
+            if isinstance(channels, (list, set, tuple)):
+                channels = ','.join(channels)
+            self.RAW('LIST %s' % channels)
+        else:
+            self.RAW('LIST')
+        return stream
 
     def PART(self, channels, message=None):
         if isinstance(channels, list):
@@ -122,37 +264,171 @@ class Client(object):
         self.irc_c = irc_c
         irc_c.client = self
         self.reconnect = True
+        #Outbound lines are paced through here
+        self.flood = FloodControl(self.config.flood)
+        #Recent connect failures by server, known bad servers go last
+        self.health = collections.defaultdict(int)
+        #TLS sessions to resume, by (host, port)
+        self.tls_sessions = {}
+        if 'sender_cache' in self.config:
+            Sender.cache_size = self.config.sender_cache
+        #Capabilities the server offers and open batches, per connection
+        self._cap_available = {}
+        self._cap_ended = False
+        self._batches = {}
+        self.replies = Replies()
         self.__register_client_hooks(self.config)
 
     # The IRC client Event Loop
     # Call events for every irc message
     def _try_connect(self):
-        for server in self.servers:
+        #Healthiest servers first, config order breaks ties
+        servers = sorted(self.servers, key=lambda server: self.health[server])
+        socks = []
+        for server in servers:
             host, port, ssl = self.__parseserver(server)
-            sock = LineSocket(host, port, SSL=ssl)
-            if sock.connect():
-                self.socket = sock
-                return sock
-        return None
+            socks.append(LineSocket(
+                host, port, SSL=ssl, ssl_config=self.config.ssl,
+                encoding=self.config.encoding or 'utf-8',
+                errors=self.config.encoding_errors or 'ignore',
+                sessions=self.tls_sessions))
+
+        #Resolve everything at once then race every address of every server
+        resolves = [gevent.spawn(sock.resolve) for sock in socks]
+        gevent.joinall(resolves)
+        timeout = self.config.connect_timeout or 10
+        #Interleave servers so one dead server's addresses don't go first
+        queues = [collections.deque(resolve.value or [])
+                  for resolve in resolves]
+        attempts, owners = ([], [])
+        while any(queues):
+            for index, infos in enumerate(queues):
+                if infos:
+                    attempts.append(functools.partial(
+                        socks[index].open, infos.popleft(), timeout))
+                    owners.append(index)
+        winner, raw, outcomes = race(
+            attempts, stagger=self.config.connect_stagger or 0.25,
+            discard=lambda raw: raw.close())
+
+        #Score each server by how its own attempts went
+        for index, server in enumerate(servers):
+            results = [outcome for owner, outcome in zip(owners, outcomes)
+                       if owner == index]
+            if True in results:
+                self.health[server] = 0
+            elif False in results or not results:
+                #Failed, timed out or wouldn't even resolve
+                self.health[server] = min(self.health[server] + 1, 10)
+        if winner is None:
+            return None
+        sock = socks[owners[winner]]
+        sock.adopt(raw)
+        self.socket = sock
+        return sock
+
+    def _backoff(self, failures):
+        """ Exponential backoff with jitter between server list sweeps """
+        base = self.config.reconnect_delay or 2
+        cap = min(self.config.reconnect_max or 300,
+                  base * 2 ** min(failures - 1, 16))
+        return random.uniform(cap / 2, cap)
 
     def _fire_msg_events(self, sock, irc_c):
         while True:  # Event still running
-            raw = sock.readline()  # Yield
-            if raw:
+            lines = sock.readlines()  # Yield
+            #Everything in a batch arrived together
+            timestamp = time.time()
+            for raw in lines:
+                if not raw:
+                    continue
                 #Fire RAW MSG if it has observers
                 irc_c.events['IRC_RAW_MSG'](irc_c, raw)
                 #Parse the RAW message
-                msg = Message(irc_c, raw)
+                msg = Message(irc_c, raw, timestamp)
                 if msg:  # This is a valid message
                     #So we can do length calculations for PRIVMSG WRAPS
-                    if (msg.nick == irc_c.botnick
+                    #Check the prefix so we only build a Sender for our own
+                    botnick = irc_c.botnick
+                    prefix = msg.prefix
+                    if (botnick and prefix and prefix.startswith(botnick)
+                            and prefix[len(botnick):len(botnick) + 1] == '!'
                             and irc_c.botsender != msg.sender):
                         irc_c.botsender = msg.sender
-                    #Event for kind of message [if exists]
-                    eventKey = 'IRC_MSG_%s' % msg.kind
-                    irc_c.events[eventKey](irc_c, msg)
-                    #Event for parsed messages [if exists]
-                    irc_c.events['IRC_MSG'](irc_c, msg)
+                    #Collect IRCv3 batches
+                    if self._batches or msg.kind == 'BATCH':
+                        self._track_batch(irc_c, msg)
+                    #Gather up multi-line replies
+                    if msg.kind in self.replies:
+                        self.replies.feed(irc_c, msg)
+                    #Event for kind of message and for parsed messages
+                    irc_c.events.fire_message(irc_c, msg)
+
+    def _track_batch(self, irc_c, msg):
+        """ Gather batched messages, fire IRC_BATCH when a batch ends """
+        if msg.kind == 'BATCH':
+            params = msg.args.split(' ')
+            ref = params.pop(0)
+            if ref.startswith('+') and params:
+                self._batches[ref[1:]] = Batch(ref[1:], params[0], params[1:])
+            elif ref.startswith('-'):
+                batch = self._batches.pop(ref[1:], None)
+                if batch is not None:
+                    irc_c.events['IRC_BATCH'](irc_c, batch)
+                    irc_c.events['IRC_BATCH_%s' % batch.kind.upper()](
+                        irc_c, batch)
+        batch = self._batches.get(msg.batch)
+        if batch is not None:
+            batch.messages.append(msg)
+
+    def _wanted_capabilities(self):
+        """ Capabilities from the config plus what plugins asked for """
+        if 'capabilities' in self.config:
+            caps = self.config.capabilities or []
+            if isinstance(caps, str):
+                caps = caps.replace(',', ' ').split()
+        else:
+            caps = DEFAULT_CAPABILITIES
+        wanted = set(caps)
+        wanted.update(self.irc_c.cap_requests or ())
+        if self.config.sasl:
+            wanted.add('sasl')
+        return wanted
+
+    def _sasl_start(self, irc_c):
+        """ Begin SASL if we want it, True while it holds up CAP END """
+        sasl = self.config.sasl
+        if not sasl or 'sasl' not in irc_c.capabilities or irc_c.registered:
+            return False
+        mechanism = (sasl.mechanism or 'PLAIN').upper()
+        #CAP 302 servers list the mechanisms they support
+        offered = self._cap_available.get('sasl')
+        if offered and mechanism not in offered.upper().split(','):
+            print('SASL %s not offered by server (%s)' % (mechanism, offered))
+            return False
+        irc_c.RAW('AUTHENTICATE %s' % mechanism)
+        return True
+
+    def _sasl_payload(self):
+        """ Base64 chunks to answer AUTHENTICATE + with """
+        sasl = self.config.sasl
+        if (sasl.mechanism or 'PLAIN').upper() == 'EXTERNAL':
+            #The TLS client certificate is the credential
+            return ['+']
+        username = sasl.username or self.config.nick
+        payload = '%s\0%s\0%s' % (username, username, sasl.password)
+        payload = base64.b64encode(payload.encode('utf-8')).decode('ascii')
+        chunks = [payload[i:i + 400] for i in range(0, len(payload), 400)]
+        #A full last chunk needs a + so the server knows we are done
+        if len(chunks[-1]) == 400:
+            chunks.append('+')
+        return chunks
+
+    def _cap_end(self, irc_c):
+        """ Finish capability negotiation so registration can complete """
+        if not self._cap_ended and not irc_c.registered:
+            self._cap_ended = True
+            irc_c.RAW('CAP END')
 
     def run(self):
         irc_c = self.irc_c
@@ -167,13 +443,21 @@ class Client(object):
         #If servers is not a list make it one
         if not isinstance(self.servers, list):
             self.servers = self.servers.split(',')
+        failures = 0
         while self.reconnect:
             # Keep trying to reconnect going through the server list
             sock = self._try_connect()
             if sock is None:
-                gevent.sleep(10)  # Wait 10 Seconds between retries
-                print("Retrying Server List...")
+                failures += 1
+                delay = self._backoff(failures)
+                print("Retrying Server List in %.1fs..." % delay)
+                gevent.sleep(delay)
                 continue
+            failures = 0
+            #Nothing queued for the last connection should go to this one
+            self.flood.clear()
+            flood = gevent.spawn(raise_exceptions(self.flood.run), sock)
+            timers = None
             #Catch when the socket has an exception
             try:
                 #Have the line socket autofill its buffers
@@ -182,7 +466,8 @@ class Client(object):
                 gevent.sleep(0)  # Yield
                 #Fire Socket Connect Event (Always)
                 irc_c.events('IRC_SOCKET_CONNECT')(irc_c)
-                irc_c.bot_greenlets.spawn(_timers, irc_c)
+                #Timers (AUTO_PING too) must keep going when the pool is full
+                timers = irc_c.bot_greenlets.urgent.spawn(_timers, irc_c)
                 #Enter the irc event loop
                 self._fire_msg_events(sock, irc_c)
             except LineSocket.SocketError:
@@ -190,11 +475,21 @@ class Client(object):
                     self.socket.close()
                     print("Giving Greenlets Time(1s) to die..")
                     irc_c.bot_greenlets.join(timeout=1)
+                    irc_c.bot_pool.join(timeout=1)
                 except gevent.Timeout:
                     # We got a timeout kill the others
                     print("Killing Remaining Greenlets...")
                     irc_c.bot_greenlets.kill()
+                    irc_c.bot_pool.kill()
+            finally:
+                flood.kill()
+                #The next connection starts its own
+                if timers is not None:
+                    timers.kill()
         else:
+            #Let components save their state before we go
+            irc_c.events['IRC_SHUTDOWN'](irc_c)
+            irc_c.bot_greenlets.join(timeout=5)
             print("Bot Dying.")
 
     def die(self, message="Dying"):
@@ -222,16 +517,28 @@ class Client(object):
             timers.set('AUTO_PING', AUTO_PING,
                        every=options.auto_ping or 600)
 
+        #Protocol handlers are quick and don't block, run them in order
+        #right in the reader instead of paying for a greenlet each
+
         #Handle PINGs
         def PONG(irc_c, msg):
             irc_c.RAW('PONG :%s' % msg.args)
             #On a ping from the server reset our timer for auto-ping
             timers.reset('AUTO_PING', AUTO_PING)
-        events('IRC_MSG_PING').observe(PONG)
+        events('IRC_MSG_PING').observe(PONG, dispatch='inline')
 
         #On the socket connecting we should attempt to register
         def REGISTER(irc_c):
             irc_c.registered = False
+            irc_c.account = None
+            irc_c.capabilities = set()
+            self._cap_available = {}
+            self._batches = {}
+            self.replies.reset()
+            #Servers hold registration until CAP END if they know CAP
+            self._cap_ended = not self._wanted_capabilities()
+            if not self._cap_ended:
+                irc_c.RAW('CAP LS 302')
             if options.password:  # Use a password if one is issued
                 #TODO allow password to be associated with server url
                 irc_c.RAW('PASS %s' % options.password)
@@ -239,14 +546,76 @@ class Client(object):
                       % (options.user,
                          options.realname.format(version=pyaib_version)))
             irc_c.NICK(options.nick)
-        events('IRC_SOCKET_CONNECT').observe(REGISTER)
+        events('IRC_SOCKET_CONNECT').observe(REGISTER, dispatch='inline')
+
+        #IRCv3 capability negotiation
+        def CAP(irc_c, msg):
+            _, subcommand, caps = (msg.args.split(' ', 2) + ['', ''])[:3]
+            subcommand = subcommand.upper()
+            #Multiline replies have a * before the last param
+            more = caps.startswith('* ')
+            if more:
+                caps = caps[2:]
+            caps = caps.lstrip(':').split()
+            if subcommand in ('LS', 'NEW'):
+                for cap in caps:
+                    name, _, value = cap.partition('=')
+                    self._cap_available[name] = value
+                if more:
+                    return
+                request = (self._wanted_capabilities()
+                           & set(self._cap_available)) - irc_c.capabilities
+                if request:
+                    irc_c.RAW('CAP REQ :%s' % ' '.join(sorted(request)))
+                else:
+                    self._cap_end(irc_c)
+            elif subcommand == 'ACK':
+                for cap in caps:
+                    if cap.startswith('-'):
+                        irc_c.capabilities.discard(cap[1:])
+                    else:
+                        irc_c.capabilities.add(cap)
+                if not more:
+                    irc_c.events['IRC_CAP_ACK'](irc_c, caps)
+                    if not self._sasl_start(irc_c):
+                        self._cap_end(irc_c)
+            elif subcommand == 'NAK':
+                self._cap_end(irc_c)
+            elif subcommand == 'DEL':
+                for cap in caps:
+                    irc_c.capabilities.discard(cap)
+                    self._cap_available.pop(cap, None)
+        events('IRC_MSG_CAP').observe(CAP, dispatch='inline')
+
+        #SASL exchange, the server sends + when it wants our credentials
+        def AUTHENTICATE(irc_c, msg):
+            if msg.args == '+':
+                for chunk in self._sasl_payload():
+                    irc_c.RAW('AUTHENTICATE %s' % chunk)
+        events('IRC_MSG_AUTHENTICATE').observe(AUTHENTICATE,
+                                               dispatch='inline')
+
+        #RPL_LOGGEDIN
+        def LOGGEDIN(irc_c, msg):
+            _, _, irc_c.account, _ = msg.args.split(' ', 3)
+            print('Logged in as %s' % irc_c.account)
+        events('IRC_MSG_900').observe(LOGGEDIN, dispatch='inline')
+
+        #SASL is over one way or another, let registration finish
+        def SASL_DONE(irc_c, msg):
+            if msg.kind != '903':
+                print('SASL failed: %s' % msg.args)
+            self._cap_end(irc_c)
+        for numeric in ('902', '903', '904', '905', '906', '907'):
+            events('IRC_MSG_%s' % numeric).observe(SASL_DONE,
+                                                   dispatch='inline')
 
         #Trigger an IRC_ONCONNECT event on 001 msg's
         def ONCONNECT(irc_c, msg):
             irc_c.server = msg.sender
             irc_c.registered = True
             irc_c.events('IRC_ONCONNECT')(irc_c)
-        events('IRC_MSG_001').observe(ONCONNECT)
+        events('IRC_MSG_001').observe(ONCONNECT, dispatch='inline')
 
         def NICK_INUSE(irc_c, msg):
             if not irc_c.registered:
@@ -254,14 +623,16 @@ class Client(object):
             _, nick, _ = msg.args.split(' ', 2)
             #Fire event for other modules [if its watched]
             irc_c.events['IRC_NICK_INUSE'](irc_c, nick)
-        events('IRC_MSG_433').observe(NICK_INUSE)
+        events('IRC_MSG_433').observe(NICK_INUSE, dispatch='inline')
 
         #When we change nicks handle botnick updates
         def NICK(irc_c, msg):
-            if msg.nick.lower() == irc_c.botnick.lower():
+            #The old prefix is gone, don't keep it interned
+            Sender.forget(msg.prefix)
+            if irc_c.casefold(msg.nick) == irc_c.casefold(irc_c.botnick):
                 irc_c.botnick = msg.args
             irc_c.events['IRC_NICK_CHANGE'](irc_c, msg.nick, msg.args)
-        events('IRC_MSG_NICK').observe(NICK)
+        events('IRC_MSG_NICK').observe(NICK, dispatch='inline')
 
     #Parse Server Records
     # (ssl:)?host(:port)? // after ssl: is optional
@@ -280,9 +651,13 @@ class Client(object):
 
 
 class Message (object):
-    """Parse raw irc text into easy to use class"""
+    """
+        Parse raw irc text into easy to use class
+        Only prefix/kind/args are split up front, the sender and anything
+        a kind parser provides (target, channel, reply, ...) are worked out
+        the first time somebody asks for them
+    """
 
-    MSG_REGEX = re.compile(r'^(?::([^ ]+) )?([^ ]+) (.+)$')
     DIRECT_REGEX = re.compile(r'^([^ ]+) :?(.+)$')
 
     #Some Message prefixes for channel prefixes
@@ -290,41 +665,174 @@ class Message (object):
     PREFIX_HALFOP = 2
     PREFIX_VOICE = 3
 
+    #IRCv3 tag value escapes
+    TAG_ESCAPE_REGEX = re.compile(r'\\(.?)')
+    TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+    #Core fields, whatever parsers add lands in __dict__
+    __slots__ = ('raw', 'prefix', 'kind', 'args', '_timestamp', '_rawargs',
+                 '_rawtags', '_tags', '_servertime', '_sender', '_irc_c',
+                 '_botnick', '_parsed', '__dict__')
+
     # Place to store parsers for complex message types
     _parsers = {}
+    #Cheap tests that a parser will take a line, kinds without one are
+    #parsed as soon as they arrive so bad lines never get dispatched
+    _checks = {}
 
     @classmethod
-    def add_parser(cls, kind, handler):
+    def add_parser(cls, kind, handler, check=None):
         cls._parsers[kind] = handler
+        if check is None:
+            cls._checks.pop(kind, None)
+        else:
+            cls._checks[kind] = check
 
     @classmethod
     def get_parser(cls, kind):
         return cls._parsers.get(kind)
 
     def copy(self, irc_c):
-        return type(self)(irc_c, self.raw)
-
-    def __init__(self, irc_c, raw):
+        """
+            Cheap copy for handing to triggers: parsed fields are shared,
+            anything set on the copy (unparsed, reply_target) stays there
+        """
+        if not self._parsed:
+            self._parse()
+        new = object.__new__(type(self))
+        new.raw = self.raw
+        new.prefix = self.prefix
+        new.kind = self.kind
+        new.args = self.args
+        new._timestamp = self._timestamp
+        new._rawargs = self._rawargs
+        new._rawtags = self._rawtags
+        new._tags = self._tags
+        new._servertime = self._servertime
+        new._sender = self._sender
+        new._irc_c = irc_c
+        new._botnick = self._botnick
+        new._parsed = True
+        overlay = new.__dict__
+        overlay.update(self.__dict__)
+        #Methods bound to us (reply) need to be bound to the copy
+        reply = overlay.get('reply')
+        if getattr(reply, '__self__', None) is self:
+            overlay['reply'] = getattr(new, reply.__name__)
+        return new
+
+    def __init__(self, irc_c, raw, timestamp=None):
         self.raw = raw
-        match = Message.MSG_REGEX.search(raw)
-        if match is None:
+        self._irc_c = irc_c
+        #Who we were when the line arrived, not when it gets parsed
+        self._botnick = irc_c.botnick
+        self._sender = None
+        self._parsed = False
+        self._tags = self._servertime = None
+        #Time Stamp every message (Floating Point is Fine)
+        self._timestamp = time.time() if timestamp is None else timestamp
+
+        #[@tags ][:prefix ]kind args
+        if raw[:1] == '@':
+            self._rawtags, _, raw = raw[1:].partition(' ')
+        else:
+            self._rawtags = None
+        if raw[:1] == ':':
+            prefix, _, rest = raw[1:].partition(' ')
+        else:
+            prefix, rest = (None, raw)
+        kind, _, args = rest.partition(' ')
+        self.prefix = prefix
+        #Commands are case insensitive, events and parsers use upper case
+        self.kind = kind.upper()
+        self._rawargs = args
+        #Be nice strip off the leading : on args
+        self.args = args[1:] if args[:1] == ':' else args
+        if not kind or not args or prefix == '':
             self._error_out('IRC Message')
+        elif self.kind in Message._parsers:
+            check = Message._checks.get(self.kind)
+            if check is None:
+                self._parse()
+            elif not check(self):
+                self._error_out(self.kind)
+
+    def _parse(self):
+        """ Run the kind parser, once """
+        self._parsed = True
+        parser = Message._parsers.get(self.kind)
+        if parser is None:
+            return
+        #Anything set on us before now wins over the parser
+        preset = self.__dict__.copy()
+        #Parsers expect args as they came off the wire
+        self.args = self._rawargs
+        parser(self, self._irc_c)
+        if self.args[:1] == ':':
+            self.args = self.args[1:]
+        if preset:
+            self.__dict__.update(preset)
 
-        #If the prefix is blank its the server
-        self.sender = Sender(match.group(1) or irc_c.server)
-        self.kind = match.group(2)
-        self.args = match.group(3)
-        self.nick = self.sender.nick
+    @property
+    def tags(self):
+        """ IRCv3 message tags, split and unescaped on first access """
+        if self._tags is None:
+            tags = {}
+            if self._rawtags:
+                unescape = self._unescape
+                for tag in self._rawtags.split(';'):
+                    key, _, value = tag.partition('=')
+                    tags[key] = unescape(value) if '\\' in value else value
+            self._tags = tags
+        return self._tags
 
-        #Time Stamp every message (Floating Point is Fine)
-        self.timestamp = time.time()
+    @staticmethod
+    def _unescape(value):
+        escapes = Message.TAG_ESCAPES
+        return Message.TAG_ESCAPE_REGEX.sub(
+            lambda m: escapes.get(m.group(1), m.group(1)), value)
 
-        #Handle more message types
-        if self.kind in Message._parsers:
-            Message._parsers[self.kind](self, irc_c)
+    @property
+    def timestamp(self):
+        """ When the server says it sent this (server-time) or we got it """
+        if self._servertime is None:
+            self._servertime = self._timestamp
+            if self._rawtags and 'time=' in self._rawtags:
+                servertime = self.tags.get('time')
+                if servertime:
+                    try:
+                        self._servertime = _parse_server_time(servertime)
+                    except ValueError:
+                        pass
+        return self._servertime
+
+    @timestamp.setter
+    def timestamp(self, timestamp):
+        self._servertime = self._timestamp = timestamp
 
-        #Be nice strip off the leading : on args
-        self.args = re.sub(r'^:', '', self.args)
+    @property
+    def batch(self):
+        """ Reference of the IRCv3 batch this message belongs to """
+        if self._rawtags and 'batch=' in self._rawtags:
+            return self.tags.get('batch')
+
+    @property
+    def sender(self):
+        if self._sender is None:
+            #If the prefix is blank its the server
+            if self.prefix:
+                self._sender = Sender.intern(self.prefix)
+            else:
+                self._sender = Sender(self._irc_c.server)
+        return self._sender
+
+    @sender.setter
+    def sender(self, sender):
+        self._sender = sender
+
+    @property
+    def nick(self):
+        return self.sender.nick
 
     def _error_out(self, text):
         print('BAD %s: %s' % (text, self.raw))
@@ -340,22 +848,32 @@ class Message (object):
 
     #Friendly get that doesnt blow up on non-existent entries
     def __getattr__(self, key):
+        if not self._parsed:
+            self._parse()
+            return self.__dict__.get(key)
         return None
 
+    def _reply(self, text):
+        self._irc_c.PRIVMSG(self.reply_target, text)
+
+    @staticmethod
+    def _is_directed(msg):
+        return Message.DIRECT_REGEX.search(msg._rawargs) is not None
+
     @staticmethod
     def _directed_message(msg, irc_c):
         match = Message.DIRECT_REGEX.search(msg.args)
         if match is None:
             return msg._error_out('PRIVMSG')
-        msg.target = match.group(1).lower()
+        msg.target = irc_c.casefold(match.group(1))
         msg.message = match.group(2)
 
         #If the target is not the bot its a channel message
-        if msg.target != irc_c.botnick:
+        if msg.target != irc_c.casefold(msg._botnick):
             msg.reply_target = msg.target
             #Strip off any message prefixes
             msg.raw_channel = msg.target.lstrip('@%+')
-            msg.channel = msg.raw_channel.lower()  # Normalized to lowercase
+            msg.channel = msg.raw_channel  # Normalized by casefold
             #Record the perfix
             if msg.target.startswith('@'):
                 msg.channel_prefix = msg.PREFIX_OP
@@ -367,54 +885,294 @@ class Message (object):
             msg.reply_target = msg.nick
 
         #Setup a reply method
-        def __reply(text):
-            irc_c.PRIVMSG(msg.reply_target, text)
-        msg.reply = __reply
+        msg.reply = msg._reply
+
+
+def _parse_server_time(stamp):
+    """ 2011-10-19T16:40:51.620Z into a unix timestamp """
+    seconds, _, fraction = stamp.rstrip('Z').partition('.')
+    timestamp = calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S'))
+    if fraction:
+        timestamp += float('0.%s' % fraction)
+    return timestamp
+
+
+class Batch(object):
+    """ An IRCv3 batch of messages (netsplit, netjoin, chathistory, ...) """
+    def __init__(self, ref, kind, params):
+        self.ref = ref
+        self.kind = kind
+        self.params = params
+        self.messages = []
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+
+WhoEntry = collections.namedtuple('WhoEntry', 'nick user host server flags '
+                                  'channel realname')
+ListEntry = collections.namedtuple('ListEntry', 'channel users topic')
+
+
+def _numeric_params(args):
+    """ Params of a numeric after our own nick, trailing included """
+    head, sep, trailing = args.partition(' :')
+    params = head.split(' ')[1:]
+    if sep:
+        params.append(trailing)
+    return params
+
+
+class Reply(object):
+    """ A multi-line numeric reply (NAMES, WHO, LIST, ...) gathered up """
+    def __init__(self, kind, key=None):
+        self.kind = kind
+        self.key = key
+        #WHOIS is by numeric, everything else is a list
+        self.items = {} if kind == 'WHOIS' else []
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class ReplyStream(object):
+    """
+        Iterate a reply as it arrives instead of after it ends
+        The buffer is bounded and the reader never waits on it, a stream
+        that falls that far behind is cut off (overflowed is set)
+    """
+    def __init__(self, replies, kind, size):
+        self.replies = replies
+        self.kind = kind
+        self.queue = gevent.queue.Queue(maxsize=size)
+        self.ended = False
+        self.overflowed = False
+
+    def put(self, item):
+        """ Called from the reader, must never block """
+        if self.ended:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except gevent.queue.Full:
+            print("%s reply stream fell %d behind, dropping it"
+                  % (self.kind, self.queue.maxsize))
+            self.overflowed = True
+            self.close()
+
+    def end(self):
+        if not self.ended:
+            self.ended = True
+            try:
+                self.queue.put_nowait(StopIteration)
+            except gevent.queue.Full:
+                pass  # The iterator sees ended once it drains the queue
+
+    def close(self):
+        """ Stop listening, what is already buffered can still be read """
+        self.replies.discard(self)
+        self.end()
+
+    def __iter__(self):
+        try:
+            while not (self.ended and self.queue.empty()):
+                item = self.queue.get()  # Yield
+                if item is StopIteration:
+                    break
+                yield item
+        finally:
+            #Broke out early or got collected, stop buffering for us
+            self.close()
+
+
+class Replies(object):
+    """ Turn multi-line numeric replies into single IRC_REPLY_<KIND> events """
+    #kind: (numerics in the reply, numerics ending it)
+    KINDS = {'NAMES': (('353',), ('366',)),
+             'WHO': (('352',), ('315',)),
+             'LIST': (('321', '322'), ('323',)),
+             'WHOIS': (('311', '312', '313', '317', '319', '330', '338',
+                        '671', '301', '276', '307', '320'), ('318',)),
+             'MOTD': (('375', '372'), ('376', '422'))}
+
+    def __init__(self):
+        self.numerics = {}
+        for kind, (body, end) in self.KINDS.items():
+            for numeric in body:
+                self.numerics[numeric] = (kind, False)
+            for numeric in end:
+                self.numerics[numeric] = (kind, True)
+        #(kind, key) -> Reply
+        self.open = {}
+        #kind -> [ReplyStream]
+        self.streams = collections.defaultdict(list)
+
+    def __contains__(self, numeric):
+        return numeric in self.numerics
+
+    def reset(self):
+        self.open.clear()
+        for streams in list(self.streams.values()):
+            for stream in streams:
+                stream.end()
+        self.streams.clear()
+
+    def stream(self, kind, size=1000):
+        stream = ReplyStream(self, kind, size)
+        self.streams[kind].append(stream)
+        return stream
+
+    def discard(self, stream):
+        streams = self.streams.get(stream.kind)
+        if streams and stream in streams:
+            streams.remove(stream)
+            if not streams:
+                del self.streams[stream.kind]
+
+    def feed(self, irc_c, msg):
+        kind, end = self.numerics[msg.kind]
+        streams = self.streams.get(kind)
+        eventKey = 'IRC_REPLY_%s' % kind
+        if eventKey not in irc_c.events and not streams:
+            return  # Nobody cares, don't hold on to anything
+        params = _numeric_params(msg.args)
+        key = self._key(kind, msg.kind, params)
+        if end:
+            reply = self.open.pop((kind, key), None) or Reply(kind, key)
+            if kind == 'WHO' and params:
+                reply.key = params[0]  # The mask we asked about
+            if streams:
+                for stream in self.streams.pop(kind):
+                    stream.end()
+            irc_c.events[eventKey](irc_c, reply)
+            return
+        item = self._item(kind, msg.kind, params)
+        if streams and item is not None:
+            for stream in list(streams):
+                stream.put(item)
+            if eventKey not in irc_c.events:
+                return
+        reply = self.open.get((kind, key))
+        if reply is None:
+            reply = self.open[(kind, key)] = Reply(kind, key)
+        if kind == 'WHOIS':
+            reply.items[msg.kind] = item
+        elif kind == 'NAMES':
+            reply.items.extend(item)
+        elif item is not None:
+            reply.items.append(item)
+
+    @staticmethod
+    def _key(kind, numeric, params):
+        """ Replies that can overlap are told apart by their subject """
+        if kind == 'NAMES' and params:
+            #353 has a channel type before the channel, 366 doesn't
+            return params[1] if numeric == '353' else params[0]
+        if kind == 'WHOIS' and params:
+            return params[0]
+        return None
+
+    @staticmethod
+    def _item(kind, numeric, params):
+        if kind == 'NAMES':
+            return params[-1].split()
+        if kind == 'WHO' and len(params) >= 7:
+            #<channel> <user> <host> <server> <nick> <flags> :<hops> <real>
+            realname = params[6].partition(' ')[2]
+            return WhoEntry(params[4], params[1], params[2], params[3],
+                            params[5], params[0], realname)
+        if kind == 'LIST':
+            if numeric == '321':
+                return None  # Just the header
+            channel, users, topic = (params + ['', '0', ''])[:3]
+            return ListEntry(channel, int(users or 0), topic)
+        if kind == 'MOTD':
+            return params[-1] if params else ''
+        return params
 
 
 #Install some common parsers
-Message.add_parser('PRIVMSG', Message._directed_message)
-Message.add_parser('NOTICE', Message._directed_message)
-Message.add_parser('INVITE', Message._directed_message)
-Message.add_parser('TOPIC', Message._directed_message)
+Message.add_parser('PRIVMSG', Message._directed_message,
+                   Message._is_directed)
+Message.add_parser('NOTICE', Message._directed_message,
+                   Message._is_directed)
+Message.add_parser('INVITE', Message._directed_message,
+                   Message._is_directed)
+Message.add_parser('TOPIC', Message._directed_message,
+                   Message._is_directed)
 
 
 class Sender(str):
     """all the logic one would need for understanding sender part of irc msg"""
+    #Interned senders by raw prefix, least recently used first
+    _cache = collections.OrderedDict()
+    #How many senders to keep interned, 0 turns interning off
+    cache_size = 1024
+
     def __new__(cls, sender):
         #Pull out each of the pieces at instance time
         if '!' in sender:
             nick, _, usermask = sender.partition('!')
             inst = str.__new__(cls, nick)
             inst._user, _, inst._hostname = usermask.partition('@')
-            return inst
+            inst._username = inst._user.lstrip('~')
+            inst._usermask = '%s@%s' % (inst._user, inst._hostname)
+            inst._raw = '%s!%s' % (nick, inst._usermask)
         else:
-            return str.__new__(cls, sender)
+            inst = str.__new__(cls, sender)
+            inst._user = inst._hostname = inst._username = None
+            inst._usermask = inst._raw = None
+        return inst
+
+    @classmethod
+    def intern(cls, prefix):
+        """ Get the shared Sender for a raw prefix """
+        cache = cls._cache
+        sender = cache.pop(prefix, None)
+        if sender is None:
+            sender = cls(prefix)
+            if not cls.cache_size:
+                return sender
+            if len(cache) >= cls.cache_size:
+                cache.popitem(last=False)
+        cache[prefix] = sender  # Most recently used
+        return sender
+
+    @classmethod
+    def forget(cls, prefix):
+        """ Drop a prefix from the cache (the nick behind it changed) """
+        cache = cls._cache
+        cache.pop(prefix, None)
 
     @property
     def raw(self):
         """ get the raw sender string """
-        if self.nick:
-            return '%s!%s@%s' % (self, self._user, self._hostname)
+        if self._hostname is not None:
+            return self._raw
         else:
             return self
 
     @property
     def nick(self):
         """ get the nick """
-        if hasattr(self, '_hostname'):
+        if self._hostname is not None:
             return self
 
     @property
     def user(self):
         """ get the user name """
-        if self.nick:
-            return self._user.lstrip('~')
+        return self._username
 
     @property
     def hostname(self):
         """ get the hostname """
-        if self.nick:
+        if self._hostname is not None:
             return self._hostname
         else:
             return self
@@ -422,5 +1180,4 @@ class Sender(str):
     @property
     def usermask(self):
         """ get the usermask user@hostname """
-        if self.nick:
-            return '%s@%s' % (self._user, self._hostname)
+        return self._usermask
@@ -56,7 +56,8 @@ class IrcBot(object):
         install('timers', self._loadComponent(Timers, False))
 
         #Load the ComponentManager and load components
-        autoload = ['triggers', 'channels', 'plugins']  # Force these to load
+        # Force these to load
+        autoload = ['isupport', 'triggers', 'channels', 'plugins']
         install('components', self._loadComponent(ComponentManager))\
             .load_configured(autoload)
 
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import collections
+import string
+import sys
+
+from .components import component_class, observes
+
+if sys.version_info.major == 2:
+    str = unicode  # noqa
+
+#Upper to lower case tables for each CASEMAPPING
+_ASCII = dict(zip(map(ord, string.ascii_uppercase),
+                  map(ord, string.ascii_lowercase)))
+_STRICT_RFC1459 = dict(_ASCII)
+_STRICT_RFC1459.update({ord('['): ord('{'), ord('\\'): ord('|'),
+                        ord(']'): ord('}')})
+_RFC1459 = dict(_STRICT_RFC1459)
+_RFC1459[ord('^')] = ord('~')
+CASEMAPPINGS = {'ascii': _ASCII,
+                'rfc1459': _RFC1459,
+                'strict-rfc1459': _STRICT_RFC1459}
+
+
+@component_class('isupport')
+class ISupport(object):
+    """
+        What the server told us about itself in RPL_ISUPPORT (005)
+        Defaults are the RFC 1459 ones until the server says otherwise
+    """
+    #Folded names kept before the cache starts over
+    CACHE_SIZE = 4096
+
+    def __init__(self, irc_c, config):
+        self.config = config
+        self.reset()
+
+    def reset(self):
+        self.tokens = {}
+        self.casemapping = 'rfc1459'
+        self.chantypes = '#&'
+        #mode -> prefix symbol, in rank order
+        self.prefix = collections.OrderedDict([('o', '@'), ('v', '+')])
+        self.chanmodes = ('b', 'k', 'l', 'imnpst')
+        self.targmax = {}
+        self.maxtargets = None
+        self.nicklen = 9
+        self.modes = 3
+        self._table = CASEMAPPINGS['rfc1459']
+        self._folded = {}
+
+    @observes('IRC_SOCKET_CONNECT', dispatch='inline')
+    def _connect(self, irc_c):
+        self.reset()
+
+    @observes('IRC_MSG_005', dispatch='inline')
+    def _isupport(self, irc_c, msg):
+        #<botnick> TOKEN[=value] ... :are supported by this server
+        for token in msg.args.split(' :', 1)[0].split(' ')[1:]:
+            key, _, value = token.partition('=')
+            if key.startswith('-'):
+                self.tokens.pop(key[1:].upper(), None)
+            elif key:
+                self.tokens[key.upper()] = value
+        self._load()
+
+    def _load(self):
+        tokens = self.tokens
+        casemapping = tokens.get('CASEMAPPING', 'rfc1459').lower()
+        if casemapping != self.casemapping:
+            self.casemapping = casemapping
+            #Unknown mappings (rfc7613, utf8) get python's lower()
+            self._table = CASEMAPPINGS.get(casemapping)
+            self._folded = {}
+        self.chantypes = tokens.get('CHANTYPES', '#&')
+        if tokens.get('PREFIX'):
+            modes, _, symbols = tokens['PREFIX'].lstrip('(').partition(')')
+            self.prefix = collections.OrderedDict(zip(modes, symbols))
+        if tokens.get('CHANMODES'):
+            self.chanmodes = tuple((tokens['CHANMODES'].split(',')
+                                    + ['', '', '', ''])[:4])
+        self.targmax = {}
+        for pair in tokens.get('TARGMAX', '').split(','):
+            command, _, limit = pair.partition(':')
+            if command:
+                self.targmax[command.upper()] = int(limit) if limit else None
+        self.maxtargets = self._int('MAXTARGETS', None)
+        self.nicklen = self._int('NICKLEN', 9)
+        self.modes = self._int('MODES', 3)
+
+    def _int(self, key, default):
+        try:
+            return int(self.tokens[key])
+        except (KeyError, ValueError):
+            return default
+
+    def casefold(self, name):
+        """ Normalize a nick or channel the way the server compares them """
+        folded = self._folded.get(name)
+        if folded is None:
+            if len(self._folded) >= self.CACHE_SIZE:
+                self._folded = {}
+            if self._table is None:
+                folded = name.lower()
+            else:
+                folded = name.translate(self._table)
+            self._folded[name] = folded
+        return folded
+
+    def is_channel(self, name):
+        return bool(name) and name[0] in self.chantypes
+
+    @property
+    def prefix_symbols(self):
+        return ''.join(self.prefix.values())
+
+    def target_limit(self, command):
+        """ Targets per command from TARGMAX/MAXTARGETS, None is no limit """
+        command = command.upper()
+        if 'TARGMAX' in self.tokens:
+            return self.targmax.get(command, 1)
+        if self.maxtargets:
+            return self.maxtargets
+        #Server didn't say, one at a time is always safe
+        return 1
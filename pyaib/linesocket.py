@@ -18,24 +18,61 @@ Line based socket using gevent
 """
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
+import collections
 import errno
+import functools
 
 import gevent
-from gevent import socket
+from gevent import socket, ssl
 from gevent import queue, select
-from OpenSSL import SSL
 
-from .util.decorator import utf8Encode, utf8Decode, raise_exceptions
+try:
+    #pyOpenSSL is optional, gevent.ssl is used unless it is asked for
+    from OpenSSL import SSL
+except ImportError:
+    class SSL(object):
+        """Stand in so pyOpenSSL except clauses work without it"""
+        class Error(Exception):
+            pass
+        WantReadError = WantWriteError = ZeroReturnError = Error
+        SysCallError = Error
+        Context = None
+
+from .util.decorator import raise_exceptions
 
 
 class LineSocketBuffers(object):
     def __init__(self):
         self.readbuffer = bytearray()
         self.writebuffer = bytearray()
+        #How much of the readbuffer is known to have no line endings
+        self.scanned = 0
 
     def clear(self):
         del self.readbuffer[0:]
         del self.writebuffer[0:]
+        self.scanned = 0
+
+    def splitlines(self):
+        """
+            Pull every complete line out of the readbuffer in a single pass
+            The consumed prefix is trimmed once, and the scan offset is
+            remembered so partial lines are not rescanned on the next recv
+        """
+        buf = self.readbuffer
+        find = buf.find
+        lines = []
+        start = 0
+        end = find(LINEENDING, self.scanned)
+        while end != -1:
+            lines.append(bytes(buf[start:end]))
+            start = end + 2
+            end = find(LINEENDING, start)
+        if start:
+            del buf[0:start]
+        #The last byte could be the \r of a line ending split across recvs
+        self.scanned = max(len(buf) - 1, 0)
+        return lines
 
     def readbuffer_mv(self):
         return memoryview(self.readbuffer)
@@ -48,14 +85,92 @@ class LineSocketBuffers(object):
 LINEENDING = b'\r\n'
 
 
+def decode_line(line, encoding='utf-8', errors='ignore'):
+    """ Decode a single line off the wire """
+    return line.decode(encoding, errors)
+
+
+def encode_line(line, encoding='utf-8', errors='backslashreplace'):
+    """ Encode a single line for the wire, bytes pass through """
+    if isinstance(line, bytes):
+        return line
+    return line.encode(encoding, errors)
+
+
+def race(attempts, stagger=0.25, discard=None):
+    """
+        Happy eyeballs: start each attempt stagger seconds after the last
+        (sooner if it fails), the first to return wins and the rest are
+        killed. Returns (index, result, outcomes), index and result are None
+        if everything failed. outcomes has one entry per attempt: True won,
+        False failed, None never finished.
+        discard is called on results that finish after the winner.
+    """
+    done = queue.Queue()
+    running = []
+    outcomes = [None] * len(attempts)
+
+    def attempt(index, func):
+        try:
+            done.put((index, func()))
+        except Exception as e:
+            print('Connect Error: %s' % e)
+            done.put((index, None))
+
+    pending = collections.deque(enumerate(attempts))
+    outstanding = 0
+    try:
+        while pending or outstanding:
+            timeout = None
+            if pending:
+                running.append(gevent.spawn(attempt, *pending.popleft()))
+                outstanding += 1
+                if pending:
+                    timeout = stagger
+            try:
+                index, result = done.get(timeout=timeout)  # Yield
+            except queue.Empty:
+                continue  # Time to start the next attempt
+            outstanding -= 1
+            outcomes[index] = result is not None
+            if result is not None:
+                return (index, result, outcomes)
+        return (None, None, outcomes)
+    finally:
+        gevent.killall(running)
+        #Losers that finished before they were killed
+        while not done.empty():
+            index, result = done.get_nowait()
+            outcomes[index] = False if result is None else outcomes[index]
+            if result is not None and discard is not None:
+                discard(result)
+
+
 class LineSocket(object):
     """Line based socket impl takes a host and port"""
-    def __init__(self, host, port, SSL):
+    #Most lines handed to a single send (IOV_MAX is usually 1024 iovecs)
+    MAX_BATCH = 512
+
+    #TLS session resumption needs python 3.6+
+    RESUME = hasattr(ssl.SSLSocket, 'session')
+
+    def __init__(self, host, port, SSL, ssl_config=None, encoding='utf-8',
+                 errors='ignore', sessions=None):
         self.host, self.port, self.SSL = (host, port, SSL)
+        #TLS sessions by (host, port), the client keeps one across reconnects
+        self._sessions = sessions if sessions is not None else {}
+        #Codec for lines in and out, errors is the policy for decoding
+        self.encoding, self.errors = (encoding, errors)
+        #verify, cafile, certfile, keyfile and backend (native|pyopenssl)
+        self.ssl_config = ssl_config if ssl_config is not None else {}
+        #Native TLS sockets block cooperatively instead of spinning
+        self._native = False
         self._socket = None
         self._buffer = LineSocketBuffers()
         #Thread Safe Queues for
+        #_IN holds batches of lines, one batch per recv
         self._IN = queue.Queue()
+        self._pending = collections.deque()
         self._OUT = queue.Queue()
 
     #Exceptions for LineSockets
@@ -68,8 +183,95 @@ class LineSocket(object):
 
     # Connect to remote host
     def connect(self):
-        host, port = (self.host, self.port)
+        #Race all of our addresses, first one to connect wins
+        attempts = [functools.partial(self.open, info)
+                    for info in self.resolve()]
+        _, sock, _ = race(attempts, discard=lambda sock: sock.close())
+        #After all the connection attempts and sock is still none lets bomb out
+        if sock is None:
+            print('Could not open connection')
+            return False
+        self.adopt(sock)
+        return True
+
+    def resolve(self):
+        """
+            Resolve the hostname (ipv6 ready), address families interleaved
+            so a broken family doesn't hold up the other
+        """
+        try:
+            infos = socket.getaddrinfo(self.host, self.port, socket.AF_UNSPEC,
+                                       socket.SOCK_STREAM)
+        except socket.error as e:
+            print('Could not resolve %s: %s' % (self.host, e))
+            return []
+        families = collections.OrderedDict()
+        for info in infos:
+            families.setdefault(info[0], collections.deque()).append(info)
+        ordered = []
+        while families:
+            for family in list(families):
+                ordered.append(families[family].popleft())
+                if not families[family]:
+                    del families[family]
+        return ordered
+
+    def _pyopenssl(self):
+        """ Use pyOpenSSL when asked to or when gevent.ssl can't be had """
+        return self.SSL and SSL.Context is not None and (
+            self.ssl_config.get('backend') == 'pyopenssl'
+            or not hasattr(ssl, 'SSLContext'))
+
+    def open(self, info, timeout=10):
+        """ Connect (and start TLS) to a single getaddrinfo entry """
+        family, socktype, proto, canonname, sockaddr = info
+        pyopenssl = self._pyopenssl()
+
+        #Validate the socket will make
+        sock = socket.socket(family, socktype, proto)
+        try:
+            #Set Keepalives
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+            #Wrap in pyOpenSSL if asked, it handshakes on first use
+            if pyopenssl:
+                print('Starting SSL (pyOpenSSL)')
+                sock = SSL.Connection(self._pyopenssl_context(), sock)
+
+            #Try to establish the connection
+            print('Trying Connect(%s)' % repr(sockaddr))
+            sock.settimeout(timeout)
+            sock.connect(sockaddr)
+            #Handshake here so a broken TLS server loses the race
+            if pyopenssl:
+                self._handshake_pyopenssl(sock, timeout)
+            elif self.SSL:
+                sock = self._wrap_native(sock)
+        except BaseException:
+            #Includes being killed for losing the race
+            if pyopenssl:
+                try:
+                    sock.shutdown()
+                except SSL.Error as e:
+                    print('Failed to shutdown SSL: %s' % e)
+            sock.close()
+            raise
+        return sock
+
+    @staticmethod
+    def _handshake_pyopenssl(sock, timeout):
+        """ pyOpenSSL sees gevent's nonblocking fd, wait on the hub for it """
+        while True:
+            try:
+                sock.do_handshake()
+                return
+            except SSL.WantReadError:
+                socket.wait_read(sock.fileno(), timeout)  # Yield
+            except SSL.WantWriteError:
+                socket.wait_write(sock.fileno(), timeout)  # Yield
 
+    def adopt(self, sock):
+        """ Take over a socket returned by open() """
         #Clean out the buffers
         self._buffer.clear()
 
@@ -77,65 +279,68 @@ class LineSocket(object):
         if self._socket is not None:
             self.close()
 
-        # Resolve the hostname and connect (ipv6 ready)
-        sock = None
-        try:
-            for info in socket.getaddrinfo(host, port, socket.AF_UNSPEC,
-                                           socket.SOCK_STREAM):
-                family, socktype, proto, canonname, sockaddr = info
-
-                #Validate the socket will make
-                try:
-                    sock = socket.socket(family, socktype, proto)
-
-                    #Set Keepalives
-                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                except socket.error as msg:
-                    print('Socket Error: %s' % msg)
-                    sock = None
-                    continue
-
-                #Wrap in ssl if asked
-                if self.SSL:
-                    print('Starting SSL')
-                    try:
-                        ctx = SSL.Context(SSL.SSLv23_METHOD)
-                        sock = SSL.Connection(ctx, sock)
-                    except SSL.Error as err:
-                        print('Could not Initiate SSL: %s' % err)
-                        sock = None
-                        continue
-
-                #Try to establish the connection
-                try:
-                    print('Trying Connect(%s)' % repr(sockaddr))
-                    sock.settimeout(10)
-                    sock.connect(sockaddr)
-                except socket.error as msg:
-                    print('Socket Error: %s' % msg)
-                    if self.SSL:
-                        try:
-                            sock.shutdown()
-                        except SSL.Error as e:
-                            print('Failed to shutdown SSL: %s' % e)
-                    sock.close()
-                    sock = None
-                    continue
-                break
-        except Exception as e:
-            print('Some unknown exception: %s' % e)
-
-        #After all the connection attempts and sock is still none lets bomb out
-        if sock is None:
-            print('Could not open connection')
-            return False
-
-        #Set the socket to non_blocking
-        sock.setblocking(0)
+        self._native = self.SSL and not self._pyopenssl()
+        if self._native:
+            #gevent.ssl waits on the hub for whole records, so block
+            sock.settimeout(None)
+        else:
+            #Set the socket to non_blocking
+            sock.setblocking(0)
 
         print("Connection Open.")
         self._socket = sock
-        return True
+
+    def _ssl_context(self):
+        """ Build a gevent.ssl context from our ssl config """
+        config = self.ssl_config
+        ctx = ssl.create_default_context()
+        if config.get('verify', False):
+            if config.get('cafile') or config.get('capath'):
+                ctx.load_verify_locations(cafile=config.get('cafile') or None,
+                                          capath=config.get('capath') or None)
+        else:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        #Client certificate for CertFP
+        if config.get('certfile'):
+            ctx.load_cert_chain(config.get('certfile'),
+                                config.get('keyfile') or None)
+        return ctx
+
+    def _wrap_native(self, sock):
+        """ TLS handshake with gevent.ssl resuming any previous session """
+        print('Starting SSL')
+        key = (self.host, self.port)
+        options = {}
+        if self.RESUME and self._sessions.get(key) is not None:
+            options['session'] = self._sessions[key]
+        sock = self._ssl_context().wrap_socket(
+            sock, server_hostname=self.host, do_handshake_on_connect=False,
+            **options)
+        sock.do_handshake()  # Yield
+        if self.RESUME:
+            if sock.session_reused:
+                print('SSL Session Resumed')
+            self._sessions[key] = sock.session
+        return sock
+
+    def _pyopenssl_context(self):
+        """ Build a pyOpenSSL context from our ssl config """
+        config = self.ssl_config
+        ctx = SSL.Context(SSL.SSLv23_METHOD)
+        if config.get('verify', False):
+            ctx.set_verify(SSL.VERIFY_PEER, lambda conn, cert, errnum, depth,
+                           ok: bool(ok))
+            if config.get('cafile') or config.get('capath'):
+                ctx.load_verify_locations(config.get('cafile') or None,
+                                          config.get('capath') or None)
+            else:
+                ctx.set_default_verify_paths()
+        if config.get('certfile'):
+            ctx.use_certificate_file(config.get('certfile'))
+            ctx.use_privatekey_file(config.get('keyfile')
+                                    or config.get('certfile'))
+        return ctx
 
     #Start up the read and write threads
     def run(self):
@@ -152,7 +357,13 @@ class LineSocket(object):
             gevent.killall(tasks)
 
     def close(self):
-        if self.SSL:
+        if self._native and self.RESUME:
+            #TLS 1.3 tickets show up after the handshake, keep the latest
+            try:
+                self._sessions[(self.host, self.port)] = self._socket.session
+            except (AttributeError, ValueError):
+                pass
+        elif self.SSL:
             try:
                 self._socket.shutdown()
             except:
@@ -166,14 +377,17 @@ class LineSocket(object):
         while True:
             try:
                 #Wait for when the socket is ready for read
-                select.select([self._socket], [], [])  # Yield
-                data = self._socket.recv(4096)
+                #Native ssl may hold decrypted data select can't see
+                if not self._native:
+                    select.select([self._socket], [], [])  # Yield
+                data = self._socket.recv(4096)  # Yield (native ssl)
                 if not data:  # Disconnected Remote
                     eof = True
                 self._buffer.readbuffer.extend(data)
             except SSL.WantReadError:
                 pass  # Nonblocking ssl yo
-            except (SSL.ZeroReturnError, SSL.SysCallError):
+            except (SSL.ZeroReturnError, SSL.SysCallError,
+                    ssl.SSLZeroReturnError, ssl.SSLEOFError):
                 eof = True
             except socket.error as e:
                 if e.errno == errno.EAGAIN:
@@ -181,17 +395,10 @@ class LineSocket(object):
                 else:
                     raise
 
-            #If there are lines to proccess do so
-            while LINEENDING in self._buffer.readbuffer:
-                #Find the buffer offset
-                size = self._buffer.readbuffer.find(LINEENDING)
-                #Get the string from the buffer
-                line = self._buffer.readbuffer_mv()[0:size].tobytes()
-                #Place the string the the queue for safe handling
-                #Also convert it to unicode
-                self._IN.put(line)
-                #Delete the line from the buffer + 2 for line endings
-                del self._buffer.readbuffer[0:size + 2]
+            #If there are lines to proccess queue them up as one batch
+            lines = self._buffer.splitlines()
+            if lines:
+                self._IN.put(lines)
 
             # Make sure we parse our readbuffer before we return
             if eof:  # You would think reading from a disconnected socket would
@@ -199,41 +406,94 @@ class LineSocket(object):
                 raise self.SocketError('EOF')
 
     #Read Operation (Block)
-    @utf8Decode.returnValue
     def readline(self):
-        return self._IN.get()
+        if not self._pending:
+            self._pending.extend(self._IN.get())  # Yield
+        return decode_line(self._pending.popleft(), self.encoding,
+                           self.errors)
+
+    #Read everything already queued, block for at least one line if asked
+    def readlines(self, block=True):
+        pending = self._pending
+        if not pending and block:
+            pending.extend(self._IN.get())  # Yield
+        while not self._IN.empty():
+            pending.extend(self._IN.get_nowait())
+        encoding, errors = (self.encoding, self.errors)
+        lines = [line.decode(encoding, errors) for line in pending]
+        pending.clear()
+        return lines
 
     #Write Operation
     def _write(self):
         while True:
-            line = self._OUT.get()  # Yield Operation
-            self._buffer.writebuffer.extend(line + LINEENDING)
-
-            #If we have buffers to write lets write them all
-            while self._buffer.writebuffer:
-                try:
-                    gevent.sleep(0)  # This gets tight sometimes
-                    #Try to dump 4096 bytes to the socket
-                    count = self._socket.send(
-                        self._buffer.writebuffer_mv()[0:4096])
+            lines = [self._OUT.get()]  # Yield Operation
+            #Grab everything else already queued so it goes out together
+            while len(lines) < self.MAX_BATCH and not self._OUT.empty():
+                lines.append(self._OUT.get_nowait())
+            self._send(lines)
+
+    def _send(self, lines):
+        """ Send a batch of lines with as few syscalls as possible """
+        buf = self._buffer.writebuffer
+        #Scatter-gather straight from the lines on plain sockets only,
+        #pyOpenSSL hands sendmsg to the raw socket under the TLS session
+        sendmsg = None
+        if not self.SSL:
+            sendmsg = getattr(self._socket, 'sendmsg', None)
+        if sendmsg is None or buf:
+            for line in lines:
+                buf.extend(line)
+                buf.extend(LINEENDING)
+            lines = None
+
+        #If we have buffers to write lets write them all
+        while lines or buf:
+            try:
+                if lines:
+                    chunks = []
+                    for line in lines:
+                        chunks.append(line)
+                        chunks.append(LINEENDING)
+                    count = sendmsg(chunks)
+                    lines = None
+                    #Partial write, keep the rest for the next pass
+                    for chunk in chunks:
+                        if count >= len(chunk):
+                            count -= len(chunk)
+                        else:
+                            buf.extend(chunk[count:])
+                            count = 0
+                else:
+                    count = self._socket.send(self._buffer.writebuffer_mv())
                     #Remove sent len from buffer
-                    del self._buffer.writebuffer[0:count]
-                except SSL.WantReadError:
-                    gevent.sleep(0)  # Yield so this is not tight
-                except socket.error as e:
-                    if e.errno == errno.EPIPE:
-                        raise self.SocketError('Broken Pipe')
-                    else:
-                        raise self.SocketError('Err Socket Code: ' + e.errno)
-                except SSL.SysCallError as e:
-                    (errnum, errstr) = e
-                    if errnum == errno.EPIPE:
-                        raise self.SocketError(errstr)
-                    else:
-                        raise self.SocketError('SSL Syscall (%d) Error: %s'
-                                               % (errnum, errstr))
+                    del buf[0:count]
+            except SSL.WantReadError:
+                gevent.sleep(0)  # Yield so this is not tight
+            except socket.error as e:
+                if e.errno == errno.EAGAIN:
+                    #Kernel buffer is full wait till we can write again
+                    select.select([], [self._socket], [])  # Yield
+                elif e.errno == errno.EPIPE:
+                    raise self.SocketError('Broken Pipe')
+                else:
+                    raise self.SocketError('Err Socket Code: %s' % e.errno)
+            except SSL.SysCallError as e:
+                (errnum, errstr) = e.args
+                if errnum == errno.EPIPE:
+                    raise self.SocketError(errstr)
+                else:
+                    raise self.SocketError('SSL Syscall (%d) Error: %s'
+                                           % (errnum, errstr))
 
     #writeline Operation [Blocking]
-    @utf8Encode
     def writeline(self, data):
-        self._OUT.put(data)
+        self._OUT.put(encode_line(data, self.encoding))
+
+    #Queue up a batch of lines to go out together
+    def writelines(self, lines):
+        encoding = self.encoding
+        put = self._OUT.put
+        for line in lines:
+            put(line if isinstance(line, bytes)
+                else line.encode(encoding, 'backslashreplace'))
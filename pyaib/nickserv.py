@@ -21,32 +21,60 @@ from .components import component_class, observes
 
 @component_class('nickserv')
 class Nickserv(object):
-    """ track channels and stuff """
+    """ Identify with nickserv and win our nick back when it frees up """
     def __init__(self, irc_c, config):
         self.config = config
         self.password = config.password
+        #Only ghost once per connection, a second 433 means it didn't work
+        self.ghosted = False
 
     @observes('IRC_ONCONNECT')
     def AUTO_IDENTIFY(self, irc_c):
         if irc_c.config.debug:
             return
-        self.identify(irc_c)
-
-        #Spawn off a watcher that makes sure we have the nick we want
-        irc_c.timers.clear('nickserv', self.watcher)
-        irc_c.timers.set('nickserv', self.watcher, every=90)
-
-    def watcher(self, irc_c, timertext):
+        self.ghosted = False
         if irc_c.botnick != irc_c.config.irc.nick:
+            self.regain(irc_c)
+        elif not irc_c.account:  # SASL already did the work
             self.identify(irc_c)
 
-    def identify(self, irc_c):
-        if irc_c.botnick != irc_c.config.irc.nick:
-            print("TRYING TO GET MY NICK BACK")
-            irc_c.PRIVMSG('nickserv', 'GHOST %s %s' % (irc_c.config.irc.nick,
-                                                       self.password))
+    @observes('IRC_NICK_INUSE')
+    def NICK_INUSE(self, irc_c, nick):
+        #Our own NICK after registration was refused, ghost the holder
+        if irc_c.registered and not self.ghosted \
+                and irc_c.casefold(nick) == irc_c.casefold(
+                    irc_c.config.irc.nick):
+            self.regain(irc_c)
+
+    @observes('IRC_NICK_CHANGE')
+    def NICK_CHANGE(self, irc_c, old, new):
+        fold = irc_c.casefold
+        wanted = fold(irc_c.config.irc.nick)
+        #botnick may or may not be updated yet, either way it was us
+        ours = fold(irc_c.botnick) in (fold(old), fold(new))
+        if ours and fold(new) == wanted:
+            if not irc_c.account:
+                self.identify(irc_c)
+        elif not ours and fold(old) == wanted:
+            self.reclaim(irc_c)
+
+    @observes('IRC_MSG_QUIT')
+    def QUIT(self, irc_c, msg):
+        if irc_c.casefold(msg.nick) == irc_c.casefold(irc_c.config.irc.nick):
+            self.reclaim(irc_c)
+
+    def reclaim(self, irc_c):
+        """ The nick we want was just given up, take it """
+        if irc_c.registered and irc_c.botnick != irc_c.config.irc.nick:
             irc_c.NICK(irc_c.config.irc.nick)
 
-        #Identify
+    def regain(self, irc_c):
+        print("TRYING TO GET MY NICK BACK")
+        self.ghosted = True
+        irc_c.PRIVMSG('nickserv', 'GHOST %s %s' % (irc_c.config.irc.nick,
+                                                   self.password))
+        irc_c.NICK(irc_c.config.irc.nick)
+
+    def identify(self, irc_c):
         print("Identifying with nickserv")
         irc_c.PRIVMSG('nickserv', 'IDENTIFY %s' % self.password)
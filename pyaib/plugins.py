@@ -47,6 +47,7 @@ def plugin_class(cls):
         return cls
 
 plugin_class.requires = component_class.requires
+plugin_class.capabilities = component_class.capabilities
 
 
 @component_class('plugins')
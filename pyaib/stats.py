@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Handler Stats Component
+
+Times every event observer, trigger and timer callback once loaded:
+
+components.load:
+    - stats
+
+stats:
+    #Seconds a handler may take before it gets logged
+    slow: 0.5
+    #Nicks allowed to use the stats trigger (anyone if not set)
+    admins: [me]
+
+Nothing is wrapped unless the component is loaded.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import functools
+import time
+
+from .components import component_class, keyword
+
+
+def handler_name(handler):
+    """ module.Class.method for bound methods, module.function otherwise """
+    owner = getattr(handler, '__self__', None)
+    func = getattr(handler, '__func__', handler)
+    name = getattr(func, '__name__', None) or type(func).__name__
+    if owner is not None:
+        cls = owner if isinstance(owner, type) else type(owner)
+        return '%s.%s.%s' % (cls.__module__, cls.__name__, name)
+    return '%s.%s' % (getattr(func, '__module__', None) or '?', name)
+
+
+class HandlerStats(object):
+    """ Calls, errors and a latency histogram for one handler """
+    #Bucket upper bounds in seconds, doubling from 1ms, the last is open
+    BOUNDS = tuple(0.001 * 2 ** i for i in range(14))
+
+    __slots__ = ('name', 'calls', 'errors', 'total', 'max', 'buckets')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for index, bound in enumerate(self.BOUNDS):
+            if seconds <= bound:
+                break
+        else:
+            index = len(self.BOUNDS)
+        self.buckets[index] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, pct):
+        """ Upper bound of the bucket holding the pct'th call """
+        if not self.calls:
+            return 0.0
+        rank = pct / 100.0 * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return self.BOUNDS[index] if index < len(self.BOUNDS) \
+                    else self.max
+        return self.max
+
+
+@component_class('stats')
+@component_class.requires('triggers')
+class Stats(object):
+    """ Per handler latency stats and slow handler logging """
+    def __init__(self, irc_c, config):
+        self.config = config
+        #0 logs everything, so only a missing setting gets the default
+        slow = config.slow if 'slow' in config else None
+        self.slow = float(slow if slow is not None else 0.5)
+        self.admins = set(irc_c.casefold(nick) for nick
+                          in (config.admins or []))
+        self._stats = {}
+        irc_c.events.instrument(self.wrap)
+        irc_c.timers.instrument(self.wrap)
+        irc_c.triggers.instrument(self.wrap)
+        print("Handler Stats Loaded")
+
+    def wrap(self, event, handler):
+        """ Time handler, counting it under its module.Class.method name """
+        name = handler_name(handler)
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = HandlerStats(name)
+        slow = self.slow
+
+        @functools.wraps(handler)
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                elapsed = time.time() - start
+                stats.add(elapsed)
+                if elapsed > slow:
+                    print("Slow handler %s for %s took %.3fs"
+                          % (name, event, elapsed))
+        return timed
+
+    def handlers(self, sort='total'):
+        """ HandlerStats for everything that ran, biggest first """
+        return sorted((stats for stats in self._stats.values()
+                       if stats.calls),
+                      key=lambda stats: getattr(stats, sort), reverse=True)
+
+    def reset(self):
+        for name in list(self._stats):
+            self._stats[name] = HandlerStats(name)
+
+    @keyword('stats')
+    def stats_trigger(self, irc_c, msg, trigger, args, kargs):
+        """[<count>] [--sort=total|max|mean|calls|errors] :: slow handlers"""
+        if self.admins and irc_c.casefold(msg.nick) not in self.admins:
+            return
+        sort = kargs.get('sort')
+        if sort not in ('total', 'max', 'mean', 'calls', 'errors'):
+            sort = 'total'
+        count = int(args[0]) if args and args[0].isdigit() else 5
+        handlers = self.handlers(sort)[:count]
+        if not handlers:
+            msg.reply('No handlers have run yet')
+        for stats in handlers:
+            msg.reply('%s: %d calls %d errors mean %.1fms p99 %.1fms '
+                      'max %.1fms' % (stats.name, stats.calls, stats.errors,
+                                      stats.mean * 1000,
+                                      stats.percentile(99) * 1000,
+                                      stats.max * 1000))
@@ -20,6 +20,8 @@ from __future__ import (absolute_import, division, print_function,
 import collections
 import time
 
+from .events import PRIORITY_HIGH
+
 #TODO Look into replacing timers with some kind of gevent construct
 
 
@@ -27,6 +29,8 @@ class Timers(object):
     """ A Timers Handler """
     def __init__(self, context):
         self.__timers = []
+        #Instrumentation, wrap(name, callable) -> callable
+        self.__wrap = None
 
     def __call__(self, irc_c):
         for timer in self.__timers:
@@ -38,9 +42,17 @@ class Timers(object):
     def set(self, *args, **keywargs):
         timer = Timer(*args, **keywargs)
         if timer:
+            if self.__wrap is not None:
+                timer.instrument(self.__wrap)
             self.__timers.append(timer)
         return bool(timer)
 
+    def instrument(self, wrap):
+        """ Run timer callables through wrap(name, callable) """
+        self.__wrap = wrap
+        for timer in self.__timers:
+            timer.instrument(wrap)
+
     def reset(self, message, callable):
         for timer in self.__timers:
             if timer.message == message and timer.callable == callable:
@@ -65,9 +77,12 @@ class Timer(object):
     # every = How long to push the 'at' time after timer rings
     # count = Number of times the timer will fire before clearing
     # callable = a callable object
-    def __init__(self, message, callable, at=None, every=None, count=None):
+    # priority = bot_greenlets priority, high so keepalives are never shed
+    def __init__(self, message, callable, at=None, every=None, count=None,
+                 priority=PRIORITY_HIGH):
         self.expired = False
         self.message = message
+        self.priority = priority
         if at is None:
             self.at = time.time()
             if every:
@@ -78,10 +93,15 @@ class Timer(object):
         self.every = every
         if isinstance(callable, collections.Callable):
             self.callable = callable
+            #What actually gets run, callable unless instrumented
+            self.runner = callable
         else:
             print('Timer Error: %s not callable' % repr(callable))
             self.expired = True
 
+    def instrument(self, wrap):
+        self.runner = wrap('timer %s' % self.message, self.callable)
+
     def __bool__(self):
         return self.expired is False
 
@@ -99,7 +119,8 @@ class Timer(object):
 
         if timestamp >= self.at:
             #Throw it into a greenlit
-            irc_c.bot_greenlets.spawn(self.callable, irc_c, self.message)
+            irc_c.bot_greenlets.submit(self.priority, self.runner, irc_c,
+                                       self.message)
 
             #Reset the timer
             if self.every:
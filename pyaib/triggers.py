@@ -138,18 +138,23 @@ class Triggers(Events):
         return [args, kwargs]
 
     #Just privmsg, rfc forbids automatic responces to notice
-    @observes('IRC_MSG_PRIVMSG')
+    #Inline, it only parses and hands off to the trigger greenlets
+    @observes('IRC_MSG_PRIVMSG', dispatch='inline')
     def _handler(self, irc_c, msg):
+        #Never trigger on our own messages (echo-message)
+        if msg.nick == irc_c.botnick:
+            return
+
         #Addressed Keywords like '<botnick>: keyword'
-        address = '%s:' % irc_c.botnick
+        address = irc_c.casefold('%s:' % irc_c.botnick)
 
         #Cleanup the message for parsing
         message = msg.message.strip()
-        if (message.startswith(self.prefix)
-                or message.lower().startswith(address)
+        addressed = irc_c.casefold(message[:len(address)]) == address
+        if (message.startswith(self.prefix) or addressed
                 or msg.channel is None):
             #Lets strip directed addressed messages
-            if message.lower().startswith(address):
+            if addressed:
                 message = message[len(address):].strip()
 
             #Get the trigger and everything else
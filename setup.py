@@ -24,7 +24,7 @@ from pyaib import __version__
 
 setup(name='pyaib',
       version=__version__,
-      packages=['pyaib', 'pyaib.dbd', 'pyaib.util'],
+      packages=['pyaib', 'pyaib.bench', 'pyaib.dbd', 'pyaib.util'],
       url='http://github.com/facebook/pyaib',
       license='Apache 2.0',
       author='Jason Fried, Facebook',
@@ -39,7 +39,9 @@ setup(name='pyaib',
           'Development Status :: 5 - Production/Stable',
       ],
       install_requires=[
-          'pyOpenSSL >= 0.12',
           'gevent >= 1.1.0',
           'PyYAML >= 3.09',
-      ])
+      ],
+      extras_require={
+          'pyopenssl': ['pyOpenSSL >= 0.12'],
+      })
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyaib import irc
+from pyaib.bench.ircd import FakeIRCd, parse
+from pyaib.bench.load import LoadGenerator, percentile
+from pyaib.bench.recording import Recording, read_recording
+from pyaib.events import Events
+from pyaib.util import data
+
+
+class FakeIRCdTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse(':nick PRIVMSG #a :hello there'),
+                         ('PRIVMSG', ['#a', 'hello there']))
+        self.assertEqual(parse('join #a,#b'), ('JOIN', ['#a,#b']))
+        self.assertEqual(parse(''), (None, []))
+
+    def test_virtual_users_join(self):
+        ircd = FakeIRCd()
+        ircd.add_virtual('Alice', ['#a', '#b'])
+        ircd.add_virtual('bob', ['#A'])
+        self.assertEqual(sorted(ircd.members('#a')), ['Alice', 'bob'])
+        self.assertEqual(ircd.members('#b'), ['Alice'])
+
+    def test_load_generator(self):
+        ircd = FakeIRCd()
+        load = LoadGenerator(ircd, 'botbot', users=20, channels=4)
+        self.assertEqual(len(load.users), 20)
+        self.assertEqual(sum(len(ircd.members(channel))
+                             for channel in load.channels), 40)
+        self.assertFalse(load.joined())
+        #A reply from the bot closes the oldest request in that channel
+        load.outstanding['#load0'].append([0.0, 1])
+        bot = ircd.add_virtual('botbot')
+        load.on_message(bot, '#load0', 'pong', 0.25)
+        self.assertEqual(load.latencies, [0.25])
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 100), 4)
+
+
+class RecordingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'bot.rec.gz')
+        self.irc_c = irc.Context()
+        self.irc_c.events = Events(self.irc_c)
+        self.recording = Recording(self.irc_c, data.Object(
+            {'path': self.path, 'flush_every': 10}))
+
+    def tearDown(self):
+        self.recording.writer.close()
+        shutil.rmtree(self.dir)
+
+    def record(self, count):
+        for i in range(count):
+            self.recording.record(self.irc_c, ':x PING :%d' % i)
+
+    def test_closed_on_shutdown(self):
+        self.irc_c.events('IRC_SHUTDOWN').observe(self.recording.close,
+                                                  'inline')
+        self.record(5)
+        self.irc_c.events('IRC_SHUTDOWN')(self.irc_c)
+        self.assertEqual([raw for _, raw in read_recording(self.path)],
+                         [':x PING :%d' % i for i in range(5)])
+
+    def test_cut_off(self):
+        #Killed without a shutdown, only flushed lines made it out
+        self.record(25)
+        lines = [raw for _, raw in read_recording(self.path)]
+        self.assertEqual(lines, [':x PING :%d' % i for i in range(20)])
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+from pyaib import irc
+from pyaib.isupport import ISupport
+from pyaib.util import data
+
+BOTMASK = 'bot!user@host.example'
+
+
+class Context(irc.Context):
+    """ Records lines instead of sending them """
+    def RAW(self, message):
+        self.sent.append(message)
+
+
+class BroadcastTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = Context()
+        self.irc_c.sent = []
+        self.irc_c.botsender = irc.Sender(BOTMASK)
+        self.irc_c.isupport = ISupport(self.irc_c, data.Object())
+
+    def isupport(self, tokens):
+        msg = irc.Message(self.irc_c, ':irc 005 bot %s :are supported'
+                          % tokens)
+        self.irc_c.isupport._isupport(self.irc_c, msg)
+
+    def targets(self):
+        return [line.split(' ')[1] for line in self.irc_c.sent]
+
+    def test_targmax(self):
+        self.isupport('TARGMAX=PRIVMSG:3,NOTICE:1 MAXTARGETS=10')
+        self.irc_c.broadcast(['a', 'b', 'c', 'b', 'd'], 'hi')
+        #Duplicates go once, TARGMAX wins over MAXTARGETS
+        self.assertEqual(self.irc_c.sent, ['PRIVMSG a,b,c :hi',
+                                           'PRIVMSG d :hi'])
+        self.irc_c.sent = []
+        self.irc_c.broadcast('a,b', 'hi', 'NOTICE')
+        self.assertEqual(self.targets(), ['a', 'b'])
+
+    def test_maxtargets(self):
+        self.isupport('MAXTARGETS=2')
+        self.irc_c.broadcast(['a', 'b', 'c'], 'hi')
+        self.assertEqual(self.targets(), ['a,b', 'c'])
+
+    def test_one_at_a_time(self):
+        self.irc_c.broadcast(['a', 'b', 'c'], 'hi')
+        self.assertEqual(self.targets(), ['a', 'b', 'c'])
+        #No isupport at all is the same
+        self.irc_c.isupport = None
+        self.irc_c.sent = []
+        self.irc_c.broadcast(['a', 'b'], 'hi')
+        self.assertEqual(self.targets(), ['a', 'b'])
+
+    def test_unlimited_stays_in_bounds(self):
+        self.isupport('TARGMAX=PRIVMSG:')
+        targets = ['#channel%03d' % i for i in range(100)]
+        self.irc_c.broadcast(targets, 'x' * 300)
+        for line in self.irc_c.sent:
+            line = ':%s %s\r\n' % (BOTMASK, line)
+            self.assertTrue(len(line.encode('utf-8')) <= 512, line)
+        #Every group gets the body in two lines
+        groups = self.targets()[::2]
+        self.assertEqual(self.targets()[1::2], groups)
+        self.assertEqual(sum((group.split(',') for group in groups), []),
+                         targets)
+        self.assertTrue(len(groups) < len(targets))
+
+    def test_body_shared_by_groups(self):
+        self.isupport('TARGMAX=PRIVMSG:2')
+        self.irc_c.broadcast(['#a', '#bb', '#c'], 'word ' * 150)
+        bodies = {}
+        for line in self.irc_c.sent:
+            _, target, body = line.split(' ', 2)
+            bodies.setdefault(target, []).append(body)
+        self.assertEqual(sorted(bodies), ['#a,#bb', '#c'])
+        #Wrapped once for the longest group, every group gets the same
+        self.assertEqual(bodies['#a,#bb'], bodies['#c'])
+        self.assertTrue(len(bodies['#c']) > 1)
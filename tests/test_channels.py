@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+import gevent
+
+from pyaib import irc
+from pyaib.channels import Channels
+from pyaib.isupport import ISupport
+from pyaib.util import data
+
+
+class Context(irc.Context):
+    """ Records JOINs instead of sending them """
+    def JOIN(self, channels):
+        self.joins.append(list(channels))
+
+
+class Item(object):
+    def __init__(self, value):
+        self.value = value
+
+    def commit(self):
+        pass
+
+
+class Db(object):
+    def __init__(self, value):
+        self.item = Item(value)
+
+    def get(self, bucket, key):
+        return self.item
+
+
+class ChannelsTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = Context()
+        self.irc_c.joins = []
+        self.irc_c.botnick = 'bot'
+        self.channels = Channels(self.irc_c,
+                                 data.Object({'join_rate': 1000}))
+
+    def tearDown(self):
+        self.channels._reset(self.irc_c)
+        if self.channels._flusher is not None:
+            self.channels._flusher.kill()
+
+    def error(self, numeric, channel):
+        msg = irc.Message(self.irc_c, ':irc %s bot %s :Cannot join'
+                          % (numeric, channel))
+        self.channels._join_error(self.irc_c, msg)
+
+    def test_join_batches(self):
+        self.channels.join(['#a', '#B'])
+        gevent.sleep(0.01)
+        self.assertEqual(self.irc_c.joins, [['#a', '#B']])
+        self.assertEqual(self.channels.pending(), set(['#a', '#b']))
+
+    def test_join_errors(self):
+        self.channels.join(['#gone', '#full', '#many'])
+        gevent.sleep(0.01)
+        self.error('403', '#gone')
+        self.error('471', '#full')
+        self.error('405', '#many')
+        #No such channel is final, the others come back around
+        self.assertEqual(set(self.channels._retry), set(['#full', '#many']))
+        self.assertEqual(self.channels._sent, {})
+
+    def test_reset_kills_joiner(self):
+        self.channels.join(['#a'])
+        joiner = self.channels._joiner
+        self.channels._reset(self.irc_c)
+        self.assertTrue(joiner.dead)
+        self.assertIsNone(self.channels._joiner)
+        gevent.sleep(0.01)
+        self.assertEqual(self.irc_c.joins, [])
+
+    def test_autojoin_keeps_order(self):
+        self.irc_c.db = Db(['#zzz', '#main', '#aaa'])
+        self.channels.config = data.Object({'autojoin': ['#ops', '#Main'],
+                                            'db': True, 'join_rate': 1000})
+        self.channels._autojoin(self.irc_c)
+        gevent.sleep(0.01)
+        order = ['#ops', '#main', '#zzz', '#aaa']
+        self.assertEqual(self.irc_c.joins, [order])
+        self.channels.flush()
+        self.assertEqual(self.irc_c.db.item.value, order)
+
+
+class MembersTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = Context()
+        self.irc_c.joins = []
+        self.irc_c.botnick = 'bot'
+        self.irc_c.isupport = ISupport(self.irc_c, data.Object())
+        self.channels = Channels(self.irc_c,
+                                 data.Object({'join_rate': 1000}))
+
+    def server(self, *lines):
+        channels = self.channels
+        parsers = {'JOIN': channels._join_parser,
+                   'PART': channels._part_parser,
+                   'KICK': channels._kick_parser}
+        handlers = {'JOIN': channels._join, 'PART': channels._part,
+                    'KICK': channels._kick, 'QUIT': channels._quit,
+                    'MODE': channels._mode, '353': channels._names_reply,
+                    '366': channels._names_end}
+        for line in lines:
+            msg = irc.Message(self.irc_c, line)
+            if msg.kind == 'NICK':
+                channels._nick(self.irc_c, msg.nick, msg.args)
+                continue
+            if msg.kind in parsers:
+                parsers[msg.kind](msg, self.irc_c)
+            handlers[msg.kind](self.irc_c, msg)
+
+    def joined(self, channel, names):
+        self.server(':bot!b@h JOIN %s' % channel,
+                    ':irc 353 bot = %s :%s' % (channel, names),
+                    ':irc 366 bot %s :End of /NAMES list.' % channel)
+
+    def members(self, channel):
+        return sorted(self.channels.members(channel))
+
+    def test_names(self):
+        self.joined('#Chan', '@bot Nick[x] +v')
+        self.assertEqual(self.members('#chan'), ['Nick[x]', 'bot', 'v'])
+        self.assertEqual(self.channels.modes('#CHAN', 'nick{x}'), '')
+        self.assertEqual(self.channels.modes('#chan', 'bot'), '@')
+        self.assertEqual(self.channels.modes('#chan', 'v'), '+')
+        self.assertIsNone(self.channels.modes('#chan', 'nobody'))
+        #A later NAMES is the whole truth
+        self.server(':irc 353 bot = #chan :@bot v',
+                    ':irc 366 bot #chan :End of /NAMES list.')
+        self.assertEqual(self.members('#chan'), ['bot', 'v'])
+        self.assertEqual(self.channels.common('nick[x]'), set())
+
+    def test_join_part_kick_quit(self):
+        self.joined('#a', 'bot')
+        self.joined('#b', 'bot')
+        self.server(':x!u@h JOIN #a', ':x!u@h JOIN #b', ':y!u@h JOIN #a')
+        self.assertEqual(self.channels.common('X'), set(['#a', '#b']))
+        self.server(':x!u@h PART #a :bye')
+        self.assertEqual(self.channels.common('x'), set(['#b']))
+        self.server(':bot!b@h KICK #a y :out')
+        self.assertEqual(self.members('#a'), ['bot'])
+        self.server(':x!u@h QUIT :gone')
+        self.assertEqual(self.members('#b'), ['bot'])
+        self.assertEqual(set(self.channels._users), set(['bot']))
+        #We left, nobody in it is tracked any more
+        self.server(':bot!b@h PART #b')
+        self.assertEqual(self.members('#b'), [])
+        self.assertEqual(self.channels.common('bot'), set(['#a']))
+
+    def test_nick_and_mode(self):
+        self.joined('#a', '@bot x')
+        self.server(':x!u@h NICK :New[1]',
+                    ':bot!b@h MODE #a +ov new{1} New[1]',
+                    ':bot!b@h MODE #a -o+b bot *!*@spam')
+        self.assertEqual(self.members('#a'), ['New[1]', 'bot'])
+        self.assertEqual(self.channels.modes('#a', 'new[1]'), '@+')
+        self.assertEqual(self.channels.modes('#a', 'bot'), '')
+        self.assertEqual(self.channels.common('x'), set())
+
+    def test_quit_during_names(self):
+        self.server(':bot!b@h JOIN #c', ':irc 353 bot = #c :bot w',
+                    ':w!u@h QUIT :gone', ':irc 366 bot #c :End')
+        self.assertEqual(self.members('#c'), ['bot'])
+        self.assertEqual(self.channels.common('w'), set())
+
+    def test_nick_during_names(self):
+        self.server(':bot!b@h JOIN #a', ':irc 353 bot = #a :@bot x y',
+                    ':y!u@h NICK :z', ':irc 366 bot #a :End')
+        self.assertEqual(self.members('#a'), ['bot', 'x', 'z'])
+        self.assertEqual(self.channels.common('z'), set(['#a']))
+        self.assertEqual(self.channels.common('y'), set())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import base64
+import unittest
+
+import gevent
+from gevent import socket
+from gevent.server import StreamServer
+
+from pyaib import irc
+from pyaib.events import Events
+from pyaib.linesocket import race
+from pyaib.timers import Timers
+from pyaib.util import data
+
+
+def make_client(config):
+    irc_c = irc.Context()
+    irc_c.config = data.CaseInsensitiveObject(config)
+    irc_c.events = Events(irc_c)
+    irc_c.timers = Timers(irc_c)
+    return irc.Client(irc_c)
+
+
+def closed_port():
+    """ A local port nothing is listening on """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class RaceTest(unittest.TestCase):
+    def test_outcomes(self):
+        def fail():
+            raise IOError('refused')
+
+        def slow():
+            gevent.sleep(1)
+            return 'slow'
+        index, result, outcomes = race([fail, lambda: 'fast', slow],
+                                       stagger=0.01)
+        self.assertEqual((index, result), (1, 'fast'))
+        self.assertEqual(outcomes, [False, True, None])
+
+    def test_all_failed(self):
+        index, result, outcomes = race([lambda: None, lambda: None],
+                                       stagger=0.01)
+        self.assertEqual((index, result), (None, None))
+        self.assertEqual(outcomes, [False, False])
+
+
+class ConnectTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StreamServer(('127.0.0.1', 0),
+                                   lambda sock, address: gevent.sleep(1))
+        self.server.start()
+        self.good = '127.0.0.1:%d' % self.server.server_port
+        self.bad = '127.0.0.1:%d' % closed_port()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_health_follows_attempts(self):
+        client = make_client({'irc': {'servers': [self.bad, self.good],
+                                      'connect_stagger': 0.05}})
+        sock = client._try_connect()
+        self.assertEqual(sock.port, self.server.server_port)
+        self.assertEqual(client.health[self.bad], 1)
+        self.assertEqual(client.health[self.good], 0)
+        sock.close()
+        #The bad server now goes last
+        client.health[self.good] = 0
+        client.servers = [self.bad, self.good]
+        sock = client._try_connect()
+        self.assertEqual(client.health[self.bad], 1)  # Never got tried
+        sock.close()
+
+    def test_all_failed(self):
+        client = make_client({'irc': {'servers': [self.bad],
+                                      'connect_stagger': 0.05}})
+        self.assertIsNone(client._try_connect())
+        self.assertEqual(client.health[self.bad], 1)
+
+
+class CapTest(unittest.TestCase):
+    def connect(self, **config):
+        config.setdefault('nick', 'bot')
+        config.setdefault('user', 'bot')
+        config.setdefault('realname', 'bot')
+        self.client = make_client({'irc': config})
+        self.irc_c = self.client.irc_c
+        self.irc_c.events('IRC_SOCKET_CONNECT')(self.irc_c)
+        return self.sent()
+
+    def sent(self):
+        flood = self.client.flood
+        return [flood._next()[1] for _ in range(flood.depth())]
+
+    def server(self, line):
+        self.irc_c.events.fire_message(self.irc_c,
+                                       irc.Message(self.irc_c, line))
+        return self.sent()
+
+    def test_default_capabilities(self):
+        self.assertEqual(self.connect()[0], 'CAP LS 302')
+        sent = self.server(':irc CAP * LS :multi-prefix server-time batch '
+                           'userhost-in-names')
+        #Nothing that changes NAMES/WHO output unless asked for
+        self.assertEqual(sent, ['CAP REQ :batch server-time'])
+        self.assertEqual(self.server(':irc CAP bot ACK :batch server-time'),
+                         ['CAP END'])
+        self.assertEqual(self.irc_c.capabilities,
+                         set(['batch', 'server-time']))
+
+    def test_multiline_ls_and_nak(self):
+        self.connect(capabilities='multi-prefix')
+        self.assertEqual(self.server(':irc CAP * LS * :sasl=PLAIN'), [])
+        self.assertEqual(self.server(':irc CAP * LS :multi-prefix'),
+                         ['CAP REQ :multi-prefix'])
+        self.assertEqual(self.server(':irc CAP bot NAK :multi-prefix'),
+                         ['CAP END'])
+
+    def test_nothing_offered(self):
+        self.connect()
+        self.assertEqual(self.server(':irc CAP * LS :'), ['CAP END'])
+
+    def test_sasl_plain(self):
+        self.connect(capabilities='', sasl={'username': 'acct',
+                                            'password': 'secret'})
+        self.assertEqual(self.server(':irc CAP * LS :sasl=PLAIN,EXTERNAL'),
+                         ['CAP REQ :sasl'])
+        self.assertEqual(self.server(':irc CAP bot ACK :sasl'),
+                         ['AUTHENTICATE PLAIN'])
+        payload = self.server('AUTHENTICATE +')
+        self.assertEqual(payload, ['AUTHENTICATE %s' % base64.b64encode(
+            b'acct\0acct\0secret').decode('ascii')])
+        self.server(':irc 900 bot bot!b@c acct :You are now logged in')
+        self.assertEqual(self.irc_c.account, 'acct')
+        self.assertEqual(self.server(':irc 903 bot :SASL successful'),
+                         ['CAP END'])
+
+    def test_sasl_mechanism_not_offered(self):
+        self.connect(capabilities='', sasl={'mechanism': 'EXTERNAL'})
+        self.server(':irc CAP * LS :sasl=PLAIN')
+        self.assertEqual(self.server(':irc CAP bot ACK :sasl'), ['CAP END'])
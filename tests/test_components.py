@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+from pyaib import irc
+from pyaib.components import triggers_on, watches
+from pyaib.isupport import ISupport
+from pyaib.util import data
+
+
+class Msg(object):
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class Plugin(object):
+    #Configured the way people type them, not casefolded
+    channels = ['#Ops', '#b[x]']
+    home = '#Home'
+
+    def __init__(self):
+        self.seen = []
+
+    @triggers_on.channel('#Ops', '#b[x]')
+    def listed(self, irc_c, msg, trigger, args, kargs):
+        self.seen.append(msg.channel)
+
+    @triggers_on.channel('channels', 'home', runtime=True)
+    def runtime(self, irc_c, msg, trigger, args, kargs):
+        self.seen.append(msg.channel)
+
+    @watches.channel('#b[x]')
+    def watched(self, irc_c, msg):
+        self.seen.append(msg.channel)
+
+
+class ChannelDecoratorTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = irc.Context()
+        self.irc_c.isupport = ISupport(self.irc_c, data.Object())
+        self.plugin = Plugin()
+
+    def fire(self, method, channel, *args):
+        #msg.channel comes in casefolded (rfc1459)
+        msg = Msg(self.irc_c.casefold(channel))
+        getattr(self.plugin, method)(self.irc_c, msg, *args)
+
+    def test_listed_channels_are_folded(self):
+        for channel in ('#OPS', '#B{X}', '#other'):
+            self.fire('listed', channel, 'trigger', [], {})
+        self.assertEqual(self.plugin.seen, ['#ops', '#b{x}'])
+
+    def test_runtime_channels_are_folded(self):
+        for channel in ('#ops', '#b{x}', '#HOME', '#other'):
+            self.fire('runtime', channel, 'trigger', [], {})
+        self.assertEqual(self.plugin.seen, ['#ops', '#b{x}', '#home'])
+
+    def test_watches_channel_is_folded(self):
+        self.fire('watched', '#B[X]')
+        self.fire('watched', '#bx')
+        self.assertEqual(self.plugin.seen, ['#b{x}'])
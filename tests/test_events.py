@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+import gevent
+
+from pyaib import irc
+from pyaib.events import (BotGreenlets, Events, PRIORITY_HIGH,
+                          PRIORITY_LOW, PRIORITY_NORMAL)
+from pyaib.util import data
+
+
+def make_context(**events):
+    irc_c = irc.Context()
+    irc_c.config = data.Object({'events': events})
+    irc_c.events = Events(irc_c)
+    return irc_c
+
+
+class BotGreenletsTest(unittest.TestCase):
+    def fill(self, pool, count):
+        for _ in range(count):
+            pool.submit(PRIORITY_NORMAL, gevent.sleep, 0.05)
+
+    def test_low_shed_before_normal(self):
+        pool = BotGreenlets(make_context(), size=10, policy='priority')
+        self.fill(pool, 8)
+        self.assertIsNone(pool.submit(PRIORITY_LOW, gevent.sleep, 0))
+        self.assertIsNotNone(pool.submit(PRIORITY_NORMAL, gevent.sleep, 0))
+        self.assertEqual(pool.dropped, 1)
+        self.assertTrue(pool.shedding)
+        pool.join()
+        gevent.sleep(0)
+        self.assertFalse(pool.shedding)
+
+    def test_drop(self):
+        pool = BotGreenlets(make_context(), size=2, policy='drop')
+        self.fill(pool, 2)
+        self.assertIsNone(pool.submit(PRIORITY_NORMAL, gevent.sleep, 0))
+        pool.join()
+
+    def test_high_never_waits(self):
+        for policy in ('priority', 'drop', 'block'):
+            pool = BotGreenlets(make_context(), size=1, policy=policy)
+            self.fill(pool, 1)
+            ran = []
+            #Would block the caller under 'block' if it went in the pool
+            with gevent.Timeout(0.01):
+                pool.submit(PRIORITY_HIGH, ran.append, policy)
+            gevent.sleep(0)
+            self.assertEqual(ran, [policy])
+            self.assertEqual(len(pool), 1)
+            pool.kill()
+
+    def test_overload_event(self):
+        irc_c = make_context(max_greenlets=1, overflow='drop')
+        seen = []
+        irc_c.events('IRC_OVERLOAD').observe(
+            lambda irc_c, overloaded, stats: seen.append(overloaded))
+        pool = irc_c.bot_greenlets
+        self.fill(pool, 1)
+        pool.submit(PRIORITY_NORMAL, gevent.sleep, 0)
+        pool.join()
+        gevent.sleep(0.01)
+        self.assertEqual(seen, [True, False])
+
+
+class EventTest(unittest.TestCase):
+    def test_default_priorities(self):
+        events = make_context(priorities={'IRC_MSG_PRIVMSG': 'low'}).events
+        self.assertEqual(events('IRC_MSG_PING').priority, PRIORITY_HIGH)
+        self.assertEqual(events('IRC_MSG_JOIN').priority, PRIORITY_LOW)
+        self.assertEqual(events('IRC_MSG_PRIVMSG').priority, PRIORITY_LOW)
+        self.assertEqual(events('IRC_MSG_TOPIC').priority, PRIORITY_NORMAL)
+
+    def test_observers_run_by_priority(self):
+        irc_c = make_context()
+        order = []
+        event = irc_c.events('X')
+        event.observe(lambda irc_c: order.append('normal'), 'inline')
+        event.observe(lambda irc_c: order.append('low'), 'inline',
+                      PRIORITY_LOW)
+        event.observe(lambda irc_c: order.append('high'), 'inline',
+                      PRIORITY_HIGH)
+        event(irc_c)
+        self.assertEqual(order, ['high', 'normal', 'low'])
+
+    def test_fire_message_kinds(self):
+        irc_c = make_context()
+        seen = []
+        irc_c.events('IRC_MSG_PRIVMSG').observe(
+            lambda irc_c, msg: seen.append('privmsg'), 'inline')
+        irc_c.events('IRC_MSG').observe(
+            lambda irc_c, msg: seen.append('any'), 'inline')
+        for line in (':a!b@c PRIVMSG #x :hi', ':a!b@c QUIT :bye',
+                     ':a!b@c privmsg #x :lower case command'):
+            irc_c.events.fire_message(irc_c, irc.Message(irc_c, line))
+        self.assertEqual(seen, ['privmsg', 'any', 'any', 'privmsg', 'any'])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import time
+import unittest
+
+import gevent
+
+from pyaib.flood import FloodControl
+
+
+class Socket(object):
+    def __init__(self):
+        self.lines = []
+
+    def writelines(self, lines):
+        now = time.time()
+        self.lines.extend((now, line) for line in lines)
+
+
+class FloodControlTest(unittest.TestCase):
+    def setUp(self):
+        self.sock = Socket()
+        self.flood = FloodControl({'burst': 2, 'rate': 4})
+        self.runner = gevent.spawn(self.flood.run, self.sock)
+        self.start = time.time()
+
+    def tearDown(self):
+        self.runner.kill()
+
+    def sent(self):
+        return [line for _, line in self.sock.lines]
+
+    def test_burst_then_rate(self):
+        for i in range(4):
+            self.flood.put('PRIVMSG #a :%d' % i)
+        gevent.sleep(0.05)
+        self.assertEqual(self.sent(), ['PRIVMSG #a :0', 'PRIVMSG #a :1'])
+        gevent.sleep(0.5)
+        self.assertEqual(len(self.sent()), 4)
+        #The last line had to wait for two tokens at 4 a second
+        self.assertTrue(self.sock.lines[-1][0] - self.start >= 0.45)
+
+    def test_priority_wakes_a_waiting_bucket(self):
+        for i in range(3):
+            self.flood.put('PRIVMSG #a :%d' % i)
+        gevent.sleep(0.05)
+        self.flood.put('PONG :irc.example.com')
+        gevent.sleep(0.02)
+        self.assertEqual(self.sent()[-1], 'PONG :irc.example.com')
+        self.assertTrue(self.sock.lines[-1][0] - self.start < 0.15)
+
+    def test_round_robin_by_target(self):
+        self.runner.kill()
+        flood = FloodControl({'burst': 10, 'rate': 0})
+        for line in ('PRIVMSG #a :1', 'PRIVMSG #a :2', 'PRIVMSG #b :1',
+                     'JOIN #c', 'PONG :x'):
+            flood.put(line)
+        order = [flood._next()[1] for _ in range(flood.depth())]
+        self.assertEqual(order, ['PONG :x', 'PRIVMSG #a :1', 'PRIVMSG #b :1',
+                                 'JOIN #c', 'PRIVMSG #a :2'])
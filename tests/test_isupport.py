@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+from pyaib import irc
+from pyaib.isupport import ISupport
+from pyaib.util import data
+
+
+class ISupportTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = irc.Context()
+        self.isupport = ISupport(self.irc_c, data.Object())
+
+    def feed(self, tokens):
+        msg = irc.Message(self.irc_c, ':irc 005 bot %s :are supported'
+                          % tokens)
+        self.isupport._isupport(self.irc_c, msg)
+
+    def test_casemappings(self):
+        fold = self.isupport.casefold
+        self.assertEqual(fold('Nick[]\\^'), 'nick{}|~')
+        self.feed('CASEMAPPING=strict-rfc1459')
+        self.assertEqual(fold('Nick[]\\^'), 'nick{}|^')
+        self.feed('CASEMAPPING=ascii')
+        self.assertEqual(fold('Nick[]\\^'), 'nick[]\\^')
+        self.feed('CASEMAPPING=rfc7613')
+        self.assertEqual(fold('\xc9T\xc9'), '\xe9t\xe9')
+
+    def test_tokens(self):
+        self.feed('PREFIX=(qov)~@+ CHANTYPES=#! CHANMODES=beI,k,l,imnt '
+                  'NICKLEN=30')
+        self.assertEqual(self.isupport.prefix_symbols, '~@+')
+        self.assertEqual(self.isupport.chanmodes,
+                         ('beI', 'k', 'l', 'imnt'))
+        self.assertEqual(self.isupport.nicklen, 30)
+        self.assertTrue(self.isupport.is_channel('!chan'))
+        self.assertFalse(self.isupport.is_channel('&chan'))
+        self.assertFalse(self.isupport.is_channel(''))
+        #A later -TOKEN puts the default back
+        self.feed('-CHANTYPES -NICKLEN')
+        self.assertTrue(self.isupport.is_channel('&chan'))
+        self.assertEqual(self.isupport.nicklen, 9)
+
+    def test_target_limit(self):
+        self.assertEqual(self.isupport.target_limit('PRIVMSG'), 1)
+        self.feed('MAXTARGETS=4')
+        self.assertEqual(self.isupport.target_limit('privmsg'), 4)
+        self.feed('TARGMAX=PRIVMSG:3,NOTICE:,JOIN:')
+        self.assertEqual(self.isupport.target_limit('PRIVMSG'), 3)
+        self.assertIsNone(self.isupport.target_limit('NOTICE'))
+        #TARGMAX wins over MAXTARGETS, unlisted commands get one
+        self.assertEqual(self.isupport.target_limit('KICK'), 1)
+
+    def test_connect_resets(self):
+        self.feed('CASEMAPPING=ascii NICKLEN=30')
+        self.isupport._connect(self.irc_c)
+        self.assertEqual(self.isupport.casemapping, 'rfc1459')
+        self.assertEqual(self.isupport.tokens, {})
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+from pyaib.linesocket import LineSocket
+
+
+class FakeSocket(object):
+    """ Records what was sent, at most limit bytes per call """
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.sent = bytearray()
+        self.calls = []
+
+    def _take(self, data):
+        data = bytes(data)
+        if self.limit is not None:
+            data = data[:self.limit]
+        self.sent.extend(data)
+        return len(data)
+
+    def send(self, data):
+        self.calls.append('send')
+        return self._take(data)
+
+    def sendmsg(self, chunks):
+        self.calls.append('sendmsg')
+        return self._take(b''.join(chunks))
+
+
+class SendTest(unittest.TestCase):
+    def line_socket(self, sock, ssl=False):
+        line_socket = LineSocket('irc.example.com', 6667, ssl)
+        line_socket._socket = sock
+        return line_socket
+
+    def test_batch_in_one_sendmsg(self):
+        sock = FakeSocket()
+        self.line_socket(sock)._send([b'PING :a', b'PRIVMSG #a :hi'])
+        self.assertEqual(sock.calls, ['sendmsg'])
+        self.assertEqual(bytes(sock.sent), b'PING :a\r\nPRIVMSG #a :hi\r\n')
+
+    def test_partial_sendmsg_keeps_the_rest(self):
+        sock = FakeSocket(limit=5)
+        self.line_socket(sock)._send([b'PING :a', b'PONG :b'])
+        self.assertEqual(bytes(sock.sent), b'PING :a\r\nPONG :b\r\n')
+        self.assertEqual(sock.calls[0], 'sendmsg')
+        self.assertTrue(all(call == 'send' for call in sock.calls[1:]))
+
+    def test_ssl_never_uses_sendmsg(self):
+        #pyOpenSSL passes sendmsg through to the plain socket
+        sock = FakeSocket()
+        self.line_socket(sock, ssl=True)._send([b'PING :a', b'PONG :b'])
+        self.assertEqual(sock.calls, ['send'])
+        self.assertEqual(bytes(sock.sent), b'PING :a\r\nPONG :b\r\n')
+
+
+class SplitLinesTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = LineSocket('irc.example.com', 6667, False)._buffer
+
+    def feed(self, data):
+        self.buffer.readbuffer.extend(data)
+        return self.buffer.splitlines()
+
+    def test_many_lines_per_recv(self):
+        self.assertEqual(self.feed(b'a\r\nb\r\nc'), [b'a', b'b'])
+        self.assertEqual(bytes(self.buffer.readbuffer), b'c')
+        self.assertEqual(self.feed(b'd\r\n'), [b'cd'])
+        self.assertEqual(bytes(self.buffer.readbuffer), b'')
+
+    def test_line_ending_split_across_recvs(self):
+        self.assertEqual(self.feed(b'abc\r'), [])
+        self.assertEqual(self.feed(b'\ndef\r\n'), [b'abc', b'def'])
+
+    def test_partial_lines_not_rescanned(self):
+        self.feed(b'x' * 100)
+        self.assertEqual(self.buffer.scanned, 99)
+        self.assertEqual(self.feed(b'y\r\n'), [b'x' * 100 + b'y'])
+        self.assertEqual(self.buffer.scanned, 0)
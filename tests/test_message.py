@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+from pyaib import irc
+from pyaib.isupport import ISupport
+from pyaib.util import data
+
+LINE = ':Nick[x]!u@h.example PRIVMSG @#Chan[1] :hello world'
+TAGGED = '@time=2011-10-19T16:40:51.620Z;x=a\\sb;y;z=\\:\\\\ ' + LINE
+
+
+class Context(irc.Context):
+    """ Records PRIVMSGs instead of sending them """
+    def PRIVMSG(self, target, msg):
+        self.sent.append((target, msg))
+
+
+def make_context():
+    irc_c = Context()
+    irc_c.sent = []
+    irc_c.botnick = 'bot'
+    irc_c.isupport = ISupport(irc_c, data.Object())
+    return irc_c
+
+
+class MessageTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = make_context()
+
+    def test_channel_message(self):
+        msg = irc.Message(self.irc_c, LINE)
+        self.assertEqual(msg.kind, 'PRIVMSG')
+        self.assertEqual(msg.prefix, 'Nick[x]!u@h.example')
+        self.assertEqual(msg.args, '@#Chan[1] :hello world')
+        self.assertEqual(msg.nick, 'Nick[x]')
+        self.assertEqual(msg.sender.hostname, 'h.example')
+        #Targets are folded with the server's casemapping
+        self.assertEqual(msg.target, '@#chan{1}')
+        self.assertEqual(msg.channel, '#chan{1}')
+        self.assertEqual(msg.channel_prefix, 1)
+        self.assertEqual(msg.reply_target, '@#chan{1}')
+        self.assertEqual(msg.message, 'hello world')
+        msg.reply('hi')
+        self.assertEqual(self.irc_c.sent, [('@#chan{1}', 'hi')])
+
+    def test_tags(self):
+        msg = irc.Message(self.irc_c, TAGGED, 5.0)
+        self.assertEqual(msg.tags, {'time': '2011-10-19T16:40:51.620Z',
+                                    'x': 'a b', 'y': '', 'z': ';\\'})
+        self.assertAlmostEqual(msg.timestamp, 1319042451.62)
+        self.assertEqual(msg.prefix, 'Nick[x]!u@h.example')
+        self.assertEqual(msg.message, 'hello world')
+        #Without server-time it is when we read it
+        self.assertEqual(irc.Message(self.irc_c, LINE, 5.0).timestamp, 5.0)
+        self.assertEqual(irc.Message(self.irc_c, LINE).tags, {})
+
+    def test_private_message(self):
+        msg = irc.Message(self.irc_c, ':a!b@c PRIVMSG Bot :hi there')
+        self.assertEqual(msg.reply_target, 'a')
+        self.assertEqual(msg.message, 'hi there')
+        self.assertIsNone(msg.channel)
+
+    def test_set_before_parse_wins(self):
+        msg = irc.Message(self.irc_c, LINE)
+        msg.message = 'changed'
+        self.assertEqual(msg.message, 'changed')
+        self.assertEqual(msg.channel, '#chan{1}')
+
+    def test_invalid(self):
+        self.assertFalse(irc.Message(self.irc_c, 'GARBAGE'))
+        self.assertFalse(irc.Message(self.irc_c, ':x PING'))
+        self.assertTrue(irc.Message(self.irc_c, ':x PING :y'))
+        #Falsy before anything is dispatched, not once it gets parsed
+        self.assertFalse(irc.Message(self.irc_c, ':a!b@c PRIVMSG #chan'))
+
+    def test_botnick_when_received(self):
+        msg = irc.Message(self.irc_c, ':a!b@c PRIVMSG Bot :hi')
+        #We change nick before anybody looks at the message
+        self.irc_c.botnick = 'other'
+        self.assertEqual(msg.reply_target, 'a')
+        self.assertIsNone(msg.channel)
+
+    def test_copy(self):
+        msg = irc.Message(self.irc_c, LINE)
+        other = make_context()
+        new = msg.copy(other)
+        self.assertEqual((new.message, new.channel, new.nick),
+                         (msg.message, msg.channel, msg.nick))
+        #Reply is bound to the copy and goes out on its context
+        new.reply('ok')
+        self.assertEqual(other.sent, [('@#chan{1}', 'ok')])
+        self.assertEqual(self.irc_c.sent, [])
+        #Fields set on the copy stay there
+        new.unparsed = 'rest'
+        self.assertIsNone(msg.unparsed)
+
+
+class WrapTest(unittest.TestCase):
+    def assertFits(self, lines, width):
+        for line in lines:
+            self.assertTrue(len(line.encode('utf-8')) <= width, line)
+
+    def test_words(self):
+        self.assertEqual(irc.wrap('a ' * 10, 5),
+                         ['a a a', 'a a a', 'a a a', 'a'])
+        self.assertEqual(irc.wrap('  short  ', 100), ['short'])
+        self.assertEqual(irc.wrap('   ', 100), [])
+
+    def test_multibyte(self):
+        #Two byte characters never get split between lines
+        self.assertEqual(irc.wrap('\xe9' * 5, 4),
+                         ['\xe9\xe9', '\xe9\xe9', '\xe9'])
+        text = '\u2603 snow ' * 40
+        lines = irc.wrap(text, 50)
+        self.assertFits(lines, 50)
+        self.assertEqual(' '.join(lines), text.strip())
+
+    def test_color_codes_kept_whole(self):
+        #A color code is one piece even when it is wider than the line
+        self.assertEqual(irc.wrap('ab\x0304,12cd', 4),
+                         ['ab', '\x0304,12', 'cd'])
+
+    def test_prefix_length(self):
+        self.assertEqual(irc.prefix_length('bot!u@h', 'PRIVMSG', '#a'),
+                         len(':bot!u@h PRIVMSG #a :'))
+        self.assertEqual(irc.prefix_length('b\xf6t', 'NOTICE', 'x'),
+                         len(':b\xf6t NOTICE x :') + 1)
+
+    def test_context_lines_fit(self):
+        irc_c = make_context()
+        irc_c.botsender = irc.Sender('bot!user@host.example')
+        lines = list(irc_c._wrap_command('PRIVMSG', '#a', '\xe9' * 600))
+        for line in lines:
+            self.assertTrue(len((':bot!user@host.example %s' % line)
+                                .encode('utf-8')) <= irc.MAX_LENGTH)
+        self.assertEqual(len(lines), 3)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+from pyaib import irc
+from pyaib.events import Events
+
+
+class Context(irc.Context):
+    pass
+
+
+class RepliesTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = Context()
+        self.irc_c.events = Events(self.irc_c)
+        self.replies = irc.Replies()
+
+    def feed(self, line):
+        msg = irc.Message(self.irc_c, line)
+        self.assertTrue(msg.kind in self.replies)
+        self.replies.feed(self.irc_c, msg)
+
+    def test_names_gathered(self):
+        got = []
+        self.irc_c.events('IRC_REPLY_NAMES').observe(
+            lambda irc_c, reply: got.append(reply), dispatch='inline')
+        self.feed(':irc 353 bot = #a :@alice +bob')
+        self.feed(':irc 353 bot = #b :carol')
+        self.feed(':irc 353 bot = #a :dave')
+        self.feed(':irc 366 bot #a :End of /NAMES list.')
+        self.assertEqual(len(got), 1)
+        self.assertEqual(got[0].key, '#a')
+        self.assertEqual(got[0].items, ['@alice', '+bob', 'dave'])
+        ##b is still open
+        self.assertEqual(list(self.replies.open), [('NAMES', '#b')])
+
+    def test_ignored_without_listeners(self):
+        self.feed(':irc 353 bot = #a :alice')
+        self.assertEqual(self.replies.open, {})
+
+    def test_stream(self):
+        stream = self.replies.stream('LIST')
+        self.feed(':irc 321 bot Channel :Users  Name')
+        self.feed(':irc 322 bot #a 5 :topic a')
+        self.feed(':irc 322 bot #b 2 :')
+        self.feed(':irc 323 bot :End of /LIST')
+        self.assertEqual(list(stream), [irc.ListEntry('#a', 5, 'topic a'),
+                                        irc.ListEntry('#b', 2, '')])
+        self.assertFalse(self.replies.streams)
+
+    def test_stream_overflow_never_blocks(self):
+        stream = self.replies.stream('LIST', 2)
+        #Nobody reads the stream, the reader must still get through
+        for i in range(5):
+            self.feed(':irc 322 bot #c%d 1 :' % i)
+        self.assertTrue(stream.overflowed)
+        self.assertFalse(self.replies.streams)
+        self.assertEqual([entry.channel for entry in stream], ['#c0', '#c1'])
+
+    def test_stream_closed_early(self):
+        stream = self.replies.stream('LIST')
+        self.feed(':irc 322 bot #a 1 :')
+        self.feed(':irc 322 bot #b 1 :')
+        for entry in stream:
+            break
+        self.assertFalse(self.replies.streams)
+        self.feed(':irc 322 bot #c 1 :')
+        self.feed(':irc 323 bot :End of /LIST')
+
+    def test_reset_ends_full_streams(self):
+        stream = self.replies.stream('LIST', 1)
+        self.feed(':irc 322 bot #a 1 :')
+        self.replies.reset()
+        self.assertEqual([entry.channel for entry in stream], ['#a'])
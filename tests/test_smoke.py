@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+import shutil
+import tempfile
+import unittest
+
+import gevent
+
+from pyaib import irc
+from pyaib.bench.ircd import FakeIRCd
+from pyaib.ircbot import IrcBot
+
+CONFIG = """
+IRC:
+    servers: 127.0.0.1:%d
+    nick: smokebot
+    user: smokebot
+    realname: smoke
+    auto_ping: 0
+channels:
+    autojoin: ['#smoke', '#Two']
+    db: false
+"""
+
+
+class SmokeTest(unittest.TestCase):
+    """ A whole bot against the bench server """
+    def setUp(self):
+        self.ircd = FakeIRCd(flood_rate=0)
+        port = self.ircd.listen()
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'smoke.conf'), 'w') as f:
+            f.write(CONFIG % port)
+        self.bot = IrcBot('smoke.conf', self.dir)
+        self.client = irc.Client(self.bot.irc_c)
+        self.runner = gevent.spawn(self.client.run)
+
+    def tearDown(self):
+        self.runner.kill()
+        self.ircd.stop()
+        shutil.rmtree(self.dir)
+
+    def wait(self, test):
+        with gevent.Timeout(5):
+            while not test():
+                gevent.sleep(0.02)
+
+    def test_join_reply_and_die(self):
+        irc_c = self.bot.irc_c
+        irc_c.events('IRC_MSG_PRIVMSG').observe(
+            lambda irc_c, msg: msg.reply('pong'))
+        self.wait(lambda: irc_c.channels.channels == set(['#smoke', '#two']))
+        self.assertEqual(irc_c.isupport.casemapping, 'rfc1459')
+
+        replies = []
+        self.ircd.listeners.append(
+            lambda user, target, text, ts: replies.append((target, text)))
+        self.ircd.say(self.ircd.add_virtual('alice', ['#smoke']),
+                      '#smoke', 'ping')
+        self.wait(lambda: replies)
+        self.assertEqual(replies, [('#smoke', 'pong')])
+        self.assertIn('alice', irc_c.channels.members('#smoke'))
+
+        self.client.die()
+        self.runner.join(timeout=3)
+        self.assertTrue(self.runner.dead)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+from pyaib import irc
+from pyaib.events import Events
+from pyaib.stats import HandlerStats, Stats
+from pyaib.timers import Timers
+from pyaib.triggers import Triggers
+from pyaib.util import data
+
+
+class Handlers(object):
+    def ok(self, irc_c):
+        pass
+
+    def broken(self, irc_c):
+        raise ValueError('broken')
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = irc.Context()
+        self.irc_c.events = Events(self.irc_c)
+        self.irc_c.timers = Timers(self.irc_c)
+        self.irc_c.triggers = Triggers(self.irc_c, data.Object())
+
+    def test_slow_setting(self):
+        self.assertEqual(Stats(self.irc_c, data.Object()).slow, 0.5)
+        #0 means log everything, not the default
+        self.assertEqual(Stats(self.irc_c, data.Object({'slow': 0})).slow, 0)
+
+    def test_counts_calls_and_errors(self):
+        handlers = Handlers()
+        event = self.irc_c.events('X')
+        event.observe(handlers.ok, 'inline')
+        stats = Stats(self.irc_c, data.Object())
+        event.observe(handlers.broken, 'inline')
+        event(self.irc_c)
+        event(self.irc_c)
+        by_name = dict((entry.name, entry) for entry in stats.handlers())
+        ok = by_name['%s.Handlers.ok' % __name__]
+        broken = by_name['%s.Handlers.broken' % __name__]
+        self.assertEqual((ok.calls, ok.errors), (2, 0))
+        self.assertEqual((broken.calls, broken.errors), (2, 2))
+
+    def test_percentile(self):
+        stats = HandlerStats('x')
+        for seconds in (0.0005, 0.0005, 0.003, 0.1):
+            stats.add(seconds)
+        self.assertEqual(stats.percentile(50), 0.001)
+        self.assertEqual(stats.percentile(75), 0.004)
+        self.assertEqual(stats.percentile(100), 0.128)
+        self.assertAlmostEqual(stats.max, 0.1)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import unittest
+
+import gevent
+
+from pyaib import irc
+from pyaib.events import Events, PRIORITY_LOW, PRIORITY_NORMAL
+from pyaib.timers import Timers
+from pyaib.util import data
+
+
+class TimersTest(unittest.TestCase):
+    def setUp(self):
+        self.irc_c = irc.Context()
+        self.irc_c.config = data.Object({'events': {'max_greenlets': 1,
+                                                    'overflow': 'drop'}})
+        self.irc_c.events = Events(self.irc_c)
+        self.timers = Timers(self.irc_c)
+
+    def test_timers_run_on_a_full_pool(self):
+        rang = []
+        self.timers.set('AUTO_PING', lambda irc_c, msg: rang.append(msg),
+                        every=60)
+        self.timers.set('chatter', lambda irc_c, msg: rang.append(msg),
+                        every=60, priority=PRIORITY_LOW)
+        pool = self.irc_c.bot_greenlets
+        pool.submit(PRIORITY_NORMAL, gevent.sleep, 0.05)
+        for timer in self.timers._Timers__timers:
+            timer.at = 0
+        self.timers(self.irc_c)
+        gevent.sleep(0)
+        #Low priority timers can still be shed
+        self.assertEqual(rang, ['AUTO_PING'])
+        pool.join()